@@ -0,0 +1,133 @@
+import os
+import time
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import TypeHandler, ApplicationHandlerStop
+
+import metrics
+from broadcast import TokenBucket
+from sharding import route_key
+
+# --- допуск входящих обновлений до обработчиков ---
+# Стоит в группе -1 перед всеми хэндлерами и отбрасывает обновление (ApplicationHandlerStop):
+#   duplicate — то же update_id или id callback-запроса уже было (повторная доставка вебхука);
+#   coalesced — тот же текст или та же кнопка от того же чата меньше COALESCE_SECONDS назад:
+#               серия одинаковых нажатий получает один ответ, на первое;
+#   throttled — у чата кончились токены: USER_RATE запросов в секунду, всплеск до USER_BURST;
+#   shed      — запрос низкого приоритета (статистика, выгрузка), а в очереди больше
+#               SHED_BACKLOG обновлений: сначала отвечаем тем, кто отмечает таблетку.
+# Один чат, который жмёт кнопку без остановки, так тратит только свои токены,
+# а остальные пользователи не ждут за его запросами.
+# На отброшенное нажатие кнопки всё равно отвечаем answer(), иначе у пользователя крутятся
+# часики; повтор не трогаем — на исходный запрос отвечает его обработчик.
+USER_RATE = float(os.environ.get("USER_RATE", "1"))
+USER_BURST = int(os.environ.get("USER_BURST", "5"))
+COALESCE_SECONDS = float(os.environ.get("COALESCE_SECONDS", "2"))
+SHED_BACKLOG = int(os.environ.get("SHED_BACKLOG", "200"))
+SEEN_SIZE = 10000  # сколько последних id помнить для отсева повторов
+PRUNE_AT = 10000  # при таком числе чатов выбрасываются давно молчащие
+
+
+class RecentSet:
+    # последние size ключей в порядке поступления
+    def __init__(self, size=SEEN_SIZE):
+        self.size = size
+        self.keys = OrderedDict()
+
+    def add(self, key):
+        # False — ключ уже был
+        if key in self.keys:
+            return False
+        self.keys[key] = None
+        if len(self.keys) > self.size:
+            self.keys.popitem(last=False)
+        return True
+
+
+def request_key(update):
+    if update.callback_query:
+        return "callback", update.callback_query.data
+    if update.message and update.message.text:
+        return "text", update.message.text
+    return None
+
+
+# сколько обновлений ждёт: очередь приложения плюс принятые процессором, но не обработанные;
+# у супервизора шардов (sharding.py) вместо Application — только update_queue и bot
+def backlog(app):
+    return app.update_queue.qsize() + getattr(getattr(app, "update_processor", None), "in_flight", 0)
+
+
+class Admission:
+    def __init__(self, low_priority=(), rate=USER_RATE, burst=USER_BURST,
+                 coalesce_seconds=COALESCE_SECONDS, shed_backlog=SHED_BACKLOG):
+        self.low_priority = set(low_priority)  # тексты кнопок и команды вида "/export"
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_seconds = coalesce_seconds
+        self.shed_backlog = shed_backlog
+        self.buckets = {}  # chat_id -> TokenBucket
+        self.last_request = {}  # (chat_id, вид, данные) -> время последнего такого запроса
+        self.seen_updates = RecentSet()
+        self.seen_callbacks = RecentSet()
+
+    def is_low_priority(self, update):
+        text = update.message.text if update.message and update.message.text else ""
+        # "/export@bot аргументы" -> "/export"
+        command = text.split(maxsplit=1)[0].split("@")[0] if text.startswith("/") else text
+        return command in self.low_priority
+
+    def _prune(self):
+        if len(self.buckets) > PRUNE_AT:
+            self.buckets = {key: bucket for key, bucket in self.buckets.items() if not bucket.idle()}
+        if len(self.last_request) > PRUNE_AT:
+            border = time.monotonic() - self.coalesce_seconds
+            self.last_request = {key: at for key, at in self.last_request.items() if at > border}
+
+    # причина отказа или None, если обновление пропускаем
+    def check(self, update, backlog=0):
+        if not self.seen_updates.add(update.update_id):
+            return "duplicate"
+        if update.callback_query and not self.seen_callbacks.add(update.callback_query.id):
+            return "duplicate"
+
+        chat_id = route_key(update)
+        key = request_key(update)
+        if key is not None:
+            now = time.monotonic()
+            key = (chat_id,) + key
+            previous = self.last_request.get(key)
+            self.last_request[key] = now
+            if previous is not None and now - previous < self.coalesce_seconds:
+                return "coalesced"
+
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            self._prune()
+            bucket = self.buckets[chat_id] = TokenBucket(self.rate, self.burst)
+        if not bucket.try_acquire():
+            return "throttled"
+
+        if backlog > self.shed_backlog and self.is_low_priority(update):
+            return "shed"
+        return None
+
+    async def gate(self, update, context):
+        reason = self.check(update, backlog(context.application))
+        if reason is not None:
+            metrics.admission_dropped(reason)
+            if update.callback_query and reason != "duplicate":
+                try:
+                    await update.callback_query.answer()
+                except TelegramError:
+                    pass
+            raise ApplicationHandlerStop
+
+
+def install(app, low_priority=()):
+    admission = Admission(low_priority)
+    app.bot_data["admission"] = admission
+    app.add_handler(TypeHandler(Update, admission.gate), group=-1)
+    return admission
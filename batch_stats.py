@@ -0,0 +1,54 @@
+from datetime import date
+from itertools import chain
+
+import numpy as np
+
+# --- отчёты для всех пользователей за один проход ---
+# История всех получателей читается из хранилища один раз и раскладывается в два
+# столбца: номер пользователя и день (date.toordinal()). Счётчики за неделю, месяц
+# и за всё время — маска по столбцу дней и np.bincount по номерам пользователей,
+# без цикла Python по каждому пользователю и без отдельного запроса к хранилищу.
+WEEK_DAYS = 7
+
+
+class BatchStats:
+    def __init__(self, users, user_idx, days):
+        self.users = users
+        self.user_idx = user_idx
+        self.days = days
+
+    # storage — синхронное хранилище (не AsyncStorage), вызывать через asyncio.to_thread
+    @classmethod
+    def load(cls, storage, users=None):
+        names, lengths, chunks = [], [], []
+        for user, ordinals in storage.iter_marks(users):
+            names.append(user)
+            lengths.append(len(ordinals))
+            chunks.append(ordinals)
+        days = np.fromiter(chain.from_iterable(chunks), dtype=np.int32, count=sum(lengths))
+        user_idx = np.repeat(np.arange(len(names), dtype=np.int32), lengths)
+        return cls(names, user_idx, days)
+
+    def __len__(self):
+        return len(self.users)
+
+    # отметок за период [start, end] включительно, массив по пользователям
+    def counts(self, start, end):
+        mask = (self.days >= start.toordinal()) & (self.days <= end.toordinal())
+        return np.bincount(self.user_idx[mask], minlength=len(self.users))
+
+    def totals(self):
+        return np.bincount(self.user_idx, minlength=len(self.users))
+
+    # неделя — последние WEEK_DAYS дней включая сегодня, месяц — с 1-го числа
+    def weekly(self, today=None):
+        today = today or date.today()
+        week = self.counts(date.fromordinal(today.toordinal() - WEEK_DAYS + 1), today)
+        month = self.counts(today.replace(day=1), today)
+        adherence = np.rint(week * 100 / WEEK_DAYS).astype(np.int32)
+        return week, month, self.totals(), adherence
+
+    # (user, week, month, total, adherence) — обычные int, готовые для f-строк
+    def rows(self, today=None):
+        columns = [c.tolist() for c in self.weekly(today)]
+        return zip(self.users, *columns)
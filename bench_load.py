@@ -0,0 +1,208 @@
+import os
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import importlib
+
+from aiohttp import web
+
+from fake_api import FakeBotAPI
+from webhook import run_app
+
+# --- нагрузочный тест: бот против локальной заглушки Bot API ---
+# Поднимает fake_api.FakeBotAPI, направляет на неё Application из bot.py, bot_ver2.py
+# или bot_ver3.py (TELEGRAM_API_URL) и гоняет N пользователей: каждый по кругу жмёт
+# кнопки сценария и ждёт ответа бота, прежде чем нажать следующую. Затем запускает
+# рассылки напоминаний и отчётов. Печатает пропускную способность, p50/p99 времени
+# от отправки обновления до ответа бота и пиковый RSS процесса (заглушка живёт в нём же).
+# Файлы данных бота создаются во временной папке.
+# Без --spammers лимиты допуска (admission.py) снимаются, чтобы мерить саму пропускную
+# способность. С --spammers N ещё N чатов без остановки жмут первую кнопку сценария,
+# лимиты действуют как в бою, а обычные пользователи думают --think мс между нажатиями.
+# Запуск: python bench_load.py bot_ver3 --users 200 --rounds 5 --latency 20 --throttle 0.01
+#         python bench_load.py bot_ver3 --users 50 --spammers 5 --think 1200
+CHAT_BASE = 100000
+REPLY_TIMEOUT = 10
+
+# шаг сценария: (тип, текст или callback_data, сколько ответов бота ждать)
+SCENARIOS = {
+    "bot": {
+        "start": [("text", "/start", 1)],
+        "round": [("text", "💊 Выпила", 1), ("text", "📋 Команды", 1)],
+    },
+    "bot_ver2": {
+        "start": [("text", "/start", 1)],
+        "round": [
+            ("text", "Выпила!", 1), ("text", "Статистика", 1),
+            ("text", "Настройки", 1), ("text", "Поменять день", 1), ("text", "Среда", 1),
+            ("callback", "done", 2),  # answerCallbackQuery + editMessageText
+        ],
+    },
+    "bot_ver3": {
+        "start": [("text", "/start", 1)],
+        "round": [
+            ("text", "💊 Выпила!", 1), ("text", "📊 Статистика", 1),
+            ("text", "⚙ Настройки", 1), ("text", "⏰ Поменять время", 1), ("text", "08:15", 1),
+            ("text", "/tz Europe/Moscow", 1),
+        ],
+    },
+}
+
+
+# рассылки, как их запускает JobQueue: (название, callback, data)
+def broadcast_jobs(name, module, chat_ids):
+    if name == "bot":
+        return [("daily_reminder", module.daily_reminder, set(chat_ids)),
+                ("weekly_report", module.weekly_report, set(chat_ids))]
+    if name == "bot_ver2":
+        return [("daily_reminder", module.send_today_reminder, None),
+                ("weekly_report", module.weekly_report, None)]
+
+    async def reminders(context):
+        await module.send_reminders(context, chat_ids)
+
+    async def reports(context):
+        await module.send_reports(context, chat_ids)
+    return [("daily_reminder", reminders, None), ("weekly_report", reports, None)]
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.lost = 0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def user(api, chat_id, steps, stats, think=0.0):
+    replies = api.replies[chat_id]
+    for kind, payload, expected in steps:
+        await asyncio.sleep(think)
+        started = time.perf_counter()
+        if kind == "callback":
+            api.push_callback(chat_id, payload)
+        else:
+            api.push_message(chat_id, payload)
+        try:
+            for _ in range(expected):
+                await asyncio.wait_for(replies.get(), REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats.lost += 1
+            continue
+        stats.latencies.append(time.perf_counter() - started)
+
+
+# шлёт одно и то же rate раз в секунду, не дожидаясь ответов; возвращает (отправлено, ответов)
+async def spammer(api, chat_id, step, rate, stop):
+    kind, payload, _ = step
+    sent = 0
+    while not stop.is_set():
+        if kind == "callback":
+            api.push_callback(chat_id, payload)
+        else:
+            api.push_message(chat_id, payload)
+        sent += 1
+        await asyncio.sleep(1 / rate)
+    return sent, api.replies[chat_id].qsize()
+
+
+async def run_job(app, callback, data):
+    done = asyncio.get_running_loop().create_future()
+
+    async def job(context):
+        try:
+            await callback(context)
+        except Exception as e:
+            done.set_exception(e)
+        else:
+            done.set_result(None)
+    app.job_queue.run_once(job, 0, data=data)
+    await done
+
+
+async def bench(args):
+    api = FakeBotAPI(args.latency / 1000, args.throttle)
+    runner = web.AppRunner(api.web_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    os.environ["TELEGRAM_API_URL"] = "http://127.0.0.1:%d" % runner.addresses[0][1]
+    os.environ.setdefault("TOKEN", "1:bench")
+    if not args.spammers:
+        os.environ.setdefault("USER_RATE", "1000000")
+        os.environ.setdefault("USER_BURST", "1000000")
+        os.environ.setdefault("COALESCE_SECONDS", "0")
+
+    module = importlib.import_module(args.bot)
+    app = module.build_app(os.environ["TOKEN"])
+    scenario = SCENARIOS[args.bot]
+    chat_ids = [CHAT_BASE + i for i in range(args.users)]
+    rss_before = peak_rss_mb()
+
+    async def serve():
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+        stats = LoadStats()
+        steps = scenario["start"] + scenario["round"] * args.rounds
+        stop = asyncio.Event()
+        spam_ids = [CHAT_BASE + args.users + i for i in range(args.spammers)]
+        spam = [asyncio.create_task(spammer(api, chat_id, scenario["round"][0], args.spam_rate, stop))
+                for chat_id in spam_ids]
+        started = time.perf_counter()
+        await asyncio.gather(*(user(api, chat_id, steps, stats, args.think / 1000) for chat_id in chat_ids))
+        duration = time.perf_counter() - started
+        stop.set()
+        print(f"Обновлений: {len(stats.latencies)} за {duration:.1f} с — {len(stats.latencies) / duration:.0f}/с, "
+              f"без ответа: {stats.lost}")
+        print(f"Время ответа: p50={stats.percentile(0.5) * 1000:.1f} мс p99={stats.percentile(0.99) * 1000:.1f} мс")
+        if spam:
+            results = await asyncio.gather(*spam)
+            print(f"Спамеры: отправлено {sum(sent for sent, _ in results)}, "
+                  f"ответов {sum(answered for _, answered in results)}")
+
+        for name, callback, data in broadcast_jobs(args.bot, module, chat_ids):
+            sent, throttled = api.calls["sendMessage"], api.throttled
+            started = time.perf_counter()
+            await run_job(app, callback, data)
+            duration = time.perf_counter() - started
+            sent = api.calls["sendMessage"] - sent - (api.throttled - throttled)
+            print(f"Рассылка {name}: {sent} сообщений за {duration:.1f} с — {sent / duration:.0f}/с, "
+                  f"429: {api.throttled - throttled}")
+        await app.updater.stop()
+
+    try:
+        await run_app(app, serve)
+    finally:
+        await runner.cleanup()
+    print(f"Пиковый RSS: {peak_rss_mb():.0f} МБ (до запуска бота {rss_before:.0f} МБ)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на заглушке Bot API")
+    parser.add_argument("bot", choices=sorted(SCENARIOS))
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3, help="сколько раз каждый пользователь проходит сценарий")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа API, мс")
+    parser.add_argument("--throttle", type=float, default=0.0, help="доля отправок, получающих 429")
+    parser.add_argument("--spammers", type=int, default=0, help="сколько чатов жмут кнопку без остановки")
+    parser.add_argument("--spam-rate", type=float, default=50.0, help="нажатий в секунду у каждого спамера")
+    parser.add_argument("--think", type=float, default=0.0, help="пауза обычного пользователя перед нажатием, мс")
+    args = parser.parse_args()
+
+    # bot*.py читают и пишут файлы данных в текущей папке
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    os.chdir(workdir)
+    print(f"{args.bot}: {args.users} пользователей x {args.rounds} кругов, данные в {workdir}")
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import sys
+import json
+import random
+import tracemalloc
+from datetime import date, timedelta
+
+import bitmap
+from dateindex import DateIndex
+
+# --- сравнение памяти: dict списков строк (data.json) против DateIndex и BitmapIndex ---
+# Запуск: python bench_memory.py [пользователей] [лет истории]
+
+
+def make_history(users, years, adherence=0.8, seed=1):
+    rng = random.Random(seed)
+    today = date(2026, 1, 1)
+    days = [(today - timedelta(days=i)).isoformat() for i in range(365 * years, 0, -1)]
+    return {str(100000000 + u): [d for d in days if rng.random() < adherence] for u in range(users)}
+
+
+def measure(build):
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size
+
+
+def build_date_index(raw):
+    index = DateIndex()
+    for user, dates in raw.items():
+        index.load(user, (date.fromisoformat(d).toordinal() for d in dates))
+    return index
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    years = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    raw_json = json.dumps(make_history(users, years))
+
+    raw, raw_size = measure(lambda: json.loads(raw_json))
+    index, index_size = measure(lambda: build_date_index(raw))
+    bitmaps, bitmap_size = measure(lambda: bitmap.from_json(raw))
+    assert bitmap.to_json(bitmaps) == raw
+
+    print(f"Пользователей: {users}, лет истории: {years}, отметок: {sum(map(len, raw.values()))}")
+    print(f"{'представление':<24}{'память, КБ':>12}{'на польз., Б':>14}")
+    for name, size in (("dict списков строк", raw_size), ("DateIndex", index_size), ("BitmapIndex", bitmap_size)):
+        print(f"{name:<24}{size / 1024:>12.0f}{size / users:>14.0f}")
+    print(f"data.json: {len(raw_json) / 1024:.0f} КБ, двоичный формат: {len(bitmap.dumps(bitmaps)) / 1024:.0f} КБ")
+
+
+if __name__ == "__main__":
+    main()
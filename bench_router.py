@@ -0,0 +1,79 @@
+import sys
+import time
+
+from telegram import Bot, Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram.ext import MessageHandler, filters
+
+from router import TextRouter
+
+# --- накладные расходы на выбор обработчика для одного обновления ---
+# Сравниваются цепочка MessageHandler(filters.Regex(...)) из bot_ver3.py,
+# где Application по очереди зовёт check_update, и TextRouter с поиском в словаре.
+# Отдельно — сборка ReplyKeyboardMarkup на каждый ответ против готовой константы.
+# Запуск: python bench_router.py [число повторов]
+BUTTONS = ["💊 Выпила!", "📊 Статистика", "⚙ Настройки", "⏱ Тестовое уведомление"]
+TEXTS = BUTTONS + ["⏰ Поменять время", "12:30", "просто текст"]
+
+
+async def noop(update, context):
+    pass
+
+
+def make_update(bot, i, text):
+    return Update.de_json({
+        "update_id": i,
+        "message": {
+            "message_id": i, "date": 0, "text": text,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+        },
+    }, bot)
+
+
+def first_match(handlers, update):
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return handler
+    return None
+
+
+def timeit(func, updates, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for update in updates:
+            func(update)
+    return (time.perf_counter() - started) / (rounds * len(updates)) * 1e9
+
+
+def build_menu():
+    return ReplyKeyboardMarkup([
+        [KeyboardButton("📊 Статистика"), KeyboardButton("💊 Выпила!")],
+        [KeyboardButton("⚙ Настройки")]
+    ], resize_keyboard=True)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bot = Bot("1:bench")
+    updates = [make_update(bot, i, text) for i, text in enumerate(TEXTS)]
+
+    regex_chain = [MessageHandler(filters.Regex(text), noop) for text in BUTTONS]
+    router = [TextRouter({text: noop for text in BUTTONS}).handler()]
+
+    regex_ns = timeit(lambda u: first_match(regex_chain, u), updates, rounds)
+    router_ns = timeit(lambda u: first_match(router, u), updates, rounds)
+    print(f"Выбор обработчика, нс на обновление ({len(TEXTS)} разных текстов):")
+    print(f"  цепочка filters.Regex: {regex_ns:8.0f}")
+    print(f"  TextRouter:            {router_ns:8.0f}  (x{regex_ns / router_ns:.1f})")
+
+    menu = build_menu()
+    build_ns = timeit(lambda u: build_menu(), updates[:1], rounds)
+    const_ns = timeit(lambda u: menu, updates[:1], rounds)
+    print("Клавиатура, нс на ответ:")
+    print(f"  сборка ReplyKeyboardMarkup: {build_ns:8.0f}")
+    print(f"  готовая константа:          {const_ns:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import signal
+import random
+import asyncio
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+from aiohttp import web
+
+from fake_api import FakeBotAPI
+from storage import FLAT_USER
+
+# --- холодный старт: время от запуска процесса до первого ответа ---
+# Для каждого сочетания хранилища (STORAGE) и числа пользователей в данных создаёт
+# временную папку с data.db или data.json (для bot_ver3 — ещё user_settings.jsonl),
+# кладёт в заглушку Bot API запрос одного из пользователей и запускает бота отдельным
+# процессом, как это делает платформа, будящая уснувший инстанс. Печатает, через сколько
+# бот впервые спросил getUpdates и через сколько ответил. Индекс для STORAGE=mmap
+# строится заранее, как после первой компактизации: меряется обычный старт, а не перенос.
+# Запуск: python bench_startup.py bot_ver3 --users 1000 100000 --storage sqlite json mmap
+CHAT_BASE = 100000
+MARKS_PER_USER = 30
+START_TIMEOUT = 120
+# для bot_ver3 — отметка: ей нужны настройки пользователя (часовой пояс), которые
+# до конца восстановления расписаний читаются из user_settings.jsonl отдельно
+REQUESTS = {"bot": "📋 Команды", "bot_ver2": "Статистика", "bot_ver3": "💊 Выпила!"}
+
+
+def seed(bot, storage, users, workdir):
+    rng = random.Random(1)
+    first = date.today() - timedelta(days=365)
+    chat_ids = [CHAT_BASE + i for i in range(users)]
+
+    def history():
+        return sorted(first + timedelta(days=d) for d in rng.sample(range(366), MARKS_PER_USER))
+
+    if bot == "bot_ver2":
+        # плоский формат — одна общая история, пользователи — получатели в settings.json
+        with open(os.path.join(workdir, "settings.json"), "w", encoding="utf-8") as f:
+            json.dump({"report_day": 0, "chat_ids": chat_ids}, f)
+        marks = ((FLAT_USER, d) for d in history())
+    else:
+        marks = ((str(chat_id), d) for chat_id in chat_ids for d in history())
+    if bot == "bot_ver3":
+        with open(os.path.join(workdir, "user_settings.jsonl"), "w", encoding="utf-8") as f:
+            for chat_id in chat_ids:
+                f.write(json.dumps({"chat_id": chat_id, "hour": 7, "minute": 30, "report_day": 0, "tz": "UTC"}) + "\n")
+
+    if storage == "sqlite":
+        from storage import SqliteStorage
+        db = SqliteStorage(os.path.join(workdir, "data.db"))
+        db.insert_marks([(user, d.toordinal()) for user, d in marks])
+        db.set_meta("migrated_from", "bench_startup")
+        db.close()
+        return chat_ids
+
+    data = {}
+    for user, d in marks:
+        data.setdefault(user, []).append(d.isoformat())
+    path = os.path.join(workdir, "data.json")
+    with open(path, "w", encoding="utf-8") as f:
+        if bot == "bot_ver2":
+            json.dump({d: True for d in data.get(FLAT_USER, [])}, f)
+        else:
+            json.dump(data, f)
+    if storage == "mmap" and bot != "bot_ver2":
+        from mmapstore import open_snapshot
+        open_snapshot(path).close()
+    return chat_ids
+
+
+async def cold_start(bot, storage, workdir, chat_id, verbose):
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.web_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    env = dict(os.environ, TOKEN="1:startup", STORAGE=storage,
+               TELEGRAM_API_URL="http://127.0.0.1:%d" % runner.addresses[0][1])
+    # запрос уже ждёт в очереди, как сообщение, которое разбудило инстанс
+    api.push_message(chat_id, REQUESTS[bot])
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), bot + ".py")
+    output = None if verbose else asyncio.subprocess.DEVNULL
+
+    started = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(sys.executable, script, cwd=workdir, env=env,
+                                                stdout=output, stderr=output)
+    polling = None
+    try:
+        reply = asyncio.ensure_future(api.replies[chat_id].get())
+        while not reply.done():
+            if polling is None and api.calls["getUpdates"]:
+                polling = time.perf_counter() - started
+            if proc.returncode is not None:
+                raise RuntimeError(f"{bot}.py завершился с кодом {proc.returncode}")
+            if time.perf_counter() - started > START_TIMEOUT:
+                raise RuntimeError(f"{bot}.py не ответил за {START_TIMEOUT} с")
+            await asyncio.wait([reply], timeout=0.002)
+        first_reply = time.perf_counter() - started
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(proc.wait(), 30)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        await runner.cleanup()
+    return polling, first_reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время холодного старта бота до первого ответа")
+    parser.add_argument("bot", choices=sorted(REQUESTS))
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 100000], help="пользователей в данных")
+    parser.add_argument("--storage", nargs="+", default=["sqlite", "json", "mmap"], choices=["sqlite", "json", "mmap"])
+    parser.add_argument("--runs", type=int, default=3, help="запусков на сочетание, берётся лучший")
+    parser.add_argument("--verbose", action="store_true", help="показывать вывод бота")
+    args = parser.parse_args()
+
+    print(f"{args.bot}: запрос {REQUESTS[args.bot]!r}, лучший из {args.runs} запусков")
+    for users in args.users:
+        for storage in args.storage:
+            workdir = tempfile.mkdtemp(prefix="bench_startup_")
+            chat_ids = seed(args.bot, storage, users, workdir)
+            results = [asyncio.run(cold_start(args.bot, storage, workdir, chat_ids[len(chat_ids) // 2], args.verbose))
+                       for _ in range(args.runs)]
+            polling, first_reply = min(results, key=lambda r: r[1])
+            print(f"{users:>8} польз. STORAGE={storage:<6}  getUpdates через {polling * 1000:6.0f} мс, "
+                  f"первый ответ через {first_reply * 1000:6.0f} мс   ({workdir})")
+
+
+if __name__ == "__main__":
+    main()
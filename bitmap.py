@@ -0,0 +1,125 @@
+import struct
+from datetime import date
+
+from storage import from_layout, to_layout, parse_day
+
+# --- компактная история: один бит на день, один bytearray на пользователя и год ---
+# Бит i года — день с порядковым номером i + 1 (1 января — бит 0).
+# Интерфейс тот же, что у DateIndex, поэтому хранилища могут держать любой из них.
+YEAR_BYTES = 46  # 366 бит
+MAGIC = b"PILLBM1\n"
+
+
+def _bit(day):
+    return day.timetuple().tm_yday - 1
+
+
+def _popcount(bits, lo, hi):
+    # число единичных бит с lo по hi включительно
+    value = int.from_bytes(bits, "little") >> lo
+    return (value & ((1 << (hi - lo + 1)) - 1)).bit_count()
+
+
+class BitmapIndex:
+    def __init__(self):
+        self.years = {}
+
+    def __contains__(self, user):
+        return user in self.years
+
+    def users(self):
+        return list(self.years)
+
+    def load(self, user, ordinals):
+        self.years[user] = {}
+        for ordinal in ordinals:
+            self.add(user, date.fromordinal(ordinal))
+
+    def add(self, user, day):
+        bits = self.years.setdefault(user, {}).get(day.year)
+        if bits is None:
+            bits = self.years[user][day.year] = bytearray(YEAR_BYTES)
+        i = _bit(day)
+        mask = 1 << (i & 7)
+        if bits[i >> 3] & mask:
+            return False
+        bits[i >> 3] |= mask
+        return True
+
+    def has(self, user, day):
+        bits = self.years.get(user, {}).get(day.year)
+        i = _bit(day)
+        return bool(bits and bits[i >> 3] & (1 << (i & 7)))
+
+    def remove_user(self, user):
+        self.years.pop(user, None)
+
+    def count(self, user, start, end):
+        years = self.years.get(user)
+        if not years or start > end:
+            return 0
+        total = 0
+        for year, bits in years.items():
+            if start.year <= year <= end.year:
+                lo = _bit(start) if year == start.year else 0
+                hi = _bit(end) if year == end.year else YEAR_BYTES * 8 - 1
+                total += _popcount(bits, lo, hi)
+        return total
+
+    def total(self, user):
+        return sum(int.from_bytes(bits, "little").bit_count() for bits in self.years.get(user, {}).values())
+
+    def ordinals(self, user):
+        return [d.toordinal() for d in self.dates(user)]
+
+    def dates(self, user):
+        result = []
+        for year, bits in sorted(self.years.get(user, {}).items()):
+            first = date(year, 1, 1).toordinal()
+            value = int.from_bytes(bits, "little")
+            while value:
+                low = value & -value
+                result.append(date.fromordinal(first + low.bit_length() - 1))
+                value ^= low
+        return result
+
+
+# --- двоичный формат ---
+# MAGIC, затем записи: длина id (u16), id в utf-8, год (u16), YEAR_BYTES байт
+def dumps(index):
+    chunks = [MAGIC]
+    for user, years in index.years.items():
+        raw_user = user.encode("utf-8")
+        for year, bits in sorted(years.items()):
+            chunks.append(struct.pack("<HH", len(raw_user), year) + raw_user + bytes(bits))
+    return b"".join(chunks)
+
+
+def loads(blob):
+    if not blob.startswith(MAGIC):
+        raise ValueError("Не похоже на файл с битовыми картами")
+    index = BitmapIndex()
+    pos = len(MAGIC)
+    while pos < len(blob):
+        user_len, year = struct.unpack_from("<HH", blob, pos)
+        pos += 4
+        user = blob[pos:pos + user_len].decode("utf-8")
+        pos += user_len
+        index.years.setdefault(user, {})[year] = bytearray(blob[pos:pos + YEAR_BYTES])
+        pos += YEAR_BYTES
+    return index
+
+
+# --- перевод из/в форматы data.json всех трёх версий бота ---
+# Повторы одной даты (bot.py) схлопываются — в битовой карте день либо отмечен, либо нет.
+def from_json(raw):
+    index = BitmapIndex()
+    for user, dates in from_layout(raw).items():
+        for d in dates:
+            index.add(user, parse_day(d))
+    return index
+
+
+def to_json(index, layout="users"):
+    data = {user: [d.isoformat() for d in index.dates(user)] for user in index.users()}
+    return to_layout(data, layout)
@@ -1,63 +1,41 @@
 import os
-import json
-from datetime import datetime, timedelta, time
+import asyncio
+from datetime import time, timedelta, datetime
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes, JobQueue
-
-DATA_FILE = "data.json"
-TOKEN = os.environ["TOKEN"]  # В Render: Environment Variables -> TOKEN
-
-# --- Работа с данными ---
-def load_data():
-    try:
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-
-def save_data(data):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f)
-
-def record_today(chat_id):
-    data = load_data()
-    today = datetime.now().strftime("%Y-%m-%d")
-    data.setdefault(str(chat_id), []).append(today)
-    save_data(data)
-
-def count_last_week(chat_id):
-    data = load_data()
-    today = datetime.now()
-    week_ago = today - timedelta(days=7)
-    dates = data.get(str(chat_id), [])
-    return sum(1 for d in dates if week_ago.strftime("%Y-%m-%d") <= d <= today.strftime("%Y-%m-%d"))
-
-def count_total(chat_id):
-    data = load_data()
-    return len(data.get(str(chat_id), []))
+from telegram.ext import CommandHandler, ContextTypes
+from storage import AsyncStorage, open_storage, close_storage
+from webhook import run, app_builder
+from broadcast import Broadcaster
+from router import TextRouter
+from metrics import timed, daily_job, install as install_metrics
+from admission import install as install_admission
+
+# --- Клавиатуры (собираются один раз) ---
+MAIN_KEYBOARD = ReplyKeyboardMarkup([
+    [KeyboardButton("💊 Выпила")],
+    [KeyboardButton("📋 Команды")]
+], resize_keyboard=True)
+REMINDER_KEYBOARD = ReplyKeyboardMarkup([[KeyboardButton("💊 Выпила")]], resize_keyboard=True)
 
 # --- Обработчики ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    keyboard = [
-        [KeyboardButton("💊 Выпила")],
-        [KeyboardButton("📋 Команды")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    context.bot_data["chat_ids"].add(chat_id)
     await update.message.reply_text(
         "Привет! Я буду напоминать тебе про таблетки.", 
-        reply_markup=reply_markup
+        reply_markup=MAIN_KEYBOARD
     )
 
 async def mark_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    record_today(chat_id)
+    await context.bot_data["storage"].record_today(str(chat_id))
     await update.message.reply_text("Зафиксировано! ✅")
 
 async def show_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    last_week = count_last_week(chat_id)
-    total = count_total(chat_id)
+    storage = context.bot_data["storage"]
+    last_week = await storage.count_last_week(str(chat_id))
+    total = await storage.count_total(str(chat_id))
     text = (
         "Доступные команды:\n"
         "💊 Выпила — отметить таблетку\n"
@@ -68,37 +46,70 @@ async def show_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text)
 
 # --- Напоминания ---
+# context.job.data — множество chat_id из bot_data["chat_ids"]
 async def daily_reminder(context: ContextTypes.DEFAULT_TYPE):
-    for chat_id in context.job.chat_ids:
-        keyboard = [[KeyboardButton("💊 Выпила")]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await context.bot.send_message(chat_id, "Не забудь выпить таблетку! 💊", reply_markup=reply_markup)
+    messages = ((chat_id, "Не забудь выпить таблетку! 💊") for chat_id in list(context.job.data))
+    await context.bot_data["broadcaster"].broadcast("daily_reminder", messages, reply_markup=REMINDER_KEYBOARD)
 
+# история всех получателей читается одним проходом, счётчики — одной операцией numpy
+# (numpy импортируется при первом отчёте, а не при старте)
 async def weekly_report(context: ContextTypes.DEFAULT_TYPE):
-    for chat_id in context.job.chat_ids:
-        last_week = count_last_week(chat_id)
-        await context.bot.send_message(chat_id, f"Отчёт за неделю:\nТаблеток выпито: {last_week}")
+    from batch_stats import BatchStats
+    storage = context.bot_data["storage"].storage
+    stats = await asyncio.to_thread(BatchStats.load, storage, [str(chat_id) for chat_id in context.job.data])
+    today = datetime.now().date()
+    # то же окно, что у count_last_week
+    last_week = stats.counts(today - timedelta(days=7), today).tolist()
+    messages = [
+        (int(user), f"Отчёт за неделю:\nТаблеток выпито: {count}")
+        for user, count in zip(stats.users, last_week)
+    ]
+    await context.bot_data["broadcaster"].broadcast("weekly_report", messages)
 
-# --- Основная функция ---
-def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+# --- Сборка приложения ---
+# список пользователей читается фоном, после старта опроса: первый ответ его не ждёт.
+# В общем data.db бывают и не chat_id — например, история bot_ver2 под FLAT_USER (""),
+# такие ключи пропускаются. Ошибку задачи никто не ждёт, поэтому она печатается здесь.
+async def load_chat_ids(app):
+    try:
+        users = await asyncio.to_thread(app.bot_data["storage"].storage.users)
+        app.bot_data["chat_ids"].update(int(user) for user in users if user.lstrip("-").isdigit())
+    except Exception as e:
+        print(f"⚠ Не удалось загрузить список получателей: {e}")
+
+async def on_startup(app):
+    app.bot_data["load_chat_ids"] = asyncio.create_task(load_chat_ids(app))
+
+def build_app(token):
+    app = app_builder(token).post_init(on_startup).post_shutdown(close_storage).build()
+    app.bot_data["storage"] = AsyncStorage(open_storage())
+    app.bot_data["broadcaster"] = Broadcaster(app.bot)
+    # получатели рассылок: все, кто уже отмечался (load_chat_ids), плюс новые по /start
+    app.bot_data["chat_ids"] = set()
 
     # Команды
-    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("start", timed(start)))
     # Кнопки
-    app.add_handler(MessageHandler(filters.Regex("💊 Выпила"), mark_done))
-    app.add_handler(MessageHandler(filters.Regex("📋 Команды"), show_commands))
+    app.add_handler(TextRouter({"💊 Выпила": mark_done, "📋 Команды": show_commands}).handler())
+    # перед хэндлерами: лимит на чат, склейка повторов, «Команды» со статистикой — первыми под нож
+    install_admission(app, low_priority={"📋 Команды"})
 
     # --- Планировщик ---
     job_queue = app.job_queue
+    at = time(hour=9, minute=0)
 
     # Ежедневное напоминание в 9:00
-    job_queue.run_daily(daily_reminder, time(hour=9, minute=0))
+    job_queue.run_daily(daily_job(daily_reminder, at), at, data=app.bot_data["chat_ids"])
 
     # Еженедельный отчёт в понедельник в 9:00
-    job_queue.run_daily(weekly_report, time(hour=9, minute=0), days=(0,))  # 0 = Monday
+    job_queue.run_daily(daily_job(weekly_report, at), at, days=(0,), data=app.bot_data["chat_ids"])  # 0 = Monday
 
-    app.run_polling()
+    install_metrics(app)
+    return app
+
+# --- Основная функция ---
+def main():
+    run(build_app(os.environ["TOKEN"]))  # В Render: Environment Variables -> TOKEN
 
 if __name__ == "__main__":
     main()
@@ -2,39 +2,32 @@ import json
 import os
 from datetime import datetime, timedelta, time
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+from telegram.ext import CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+from storage import AsyncStorage, open_storage, close_storage, FLAT_USER
+from webhook import run, app_builder
+from broadcast import Broadcaster
+from scheduler import ptb_days
+from completions import FOLLOW_UPS, DailyCompletions
+from groupcommit import GroupCommit
+from metrics import timed, daily_job, install as install_metrics
+from admission import install as install_admission
 
-DATA_FILE = "data.json"
 SETTINGS_FILE = "settings.json"
 
 # ---------------- Работа с данными ----------------
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {}
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        content = f.read().strip()
-        return json.loads(content) if content else {}
-
-def save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def record_today():
-    data = load_data()
-    today = datetime.now().strftime("%Y-%m-%d")
-    if today in data:
-        return False
-    data[today] = True
-    save_data(data)
-    return True
-
-def get_stats():
-    data = load_data()
-    today = datetime.now()
-    week_ago = today - timedelta(days=7)
-    month_start = today.replace(day=1)
-    week_count = sum(1 for d in data if week_ago.strftime("%Y-%m-%d") <= d <= today.strftime("%Y-%m-%d"))
-    month_count = sum(1 for d in data if month_start.strftime("%Y-%m-%d") <= d <= today.strftime("%Y-%m-%d"))
+# Формат data.json здесь плоский ({дата: true}), все отметки общие — FLAT_USER
+async def record_today(storage):
+    return await storage.record_today(FLAT_USER)
+
+# отметка общая: после неё сегодня отмечено у всех получателей, как при загрузке на старте
+def mark_completed(context, chat_id):
+    chat_ids = [chat_id, *context.bot_data["settings"].get("chat_ids", [])]
+    context.bot_data["completions"].load(datetime.now().date(), chat_ids)
+
+async def get_stats(storage):
+    today = datetime.now().date()
+    week_count = await storage.count_range(FLAT_USER, today - timedelta(days=7), today)
+    month_count = await storage.count_range(FLAT_USER, today.replace(day=1), today)
     return week_count, month_count
 
 # ---------------- Настройки ----------------
@@ -45,120 +38,201 @@ def load_settings():
         content = f.read().strip()
         return json.loads(content) if content else {"report_day": 0}
 
-def save_settings(settings):
-    with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump(settings, f, ensure_ascii=False, indent=2)
+# изменения настроек за окно COMMIT_WINDOW сливаются: из пачки на диск идёт только
+# последнее состояние, одной атомарной записью с fsync
+def write_settings(texts):
+    tmp_path = SETTINGS_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(texts[-1])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, SETTINGS_FILE)
+
+# хэндлер отвечает только после того, как его изменение на диске
+async def commit_settings(context):
+    commits = context.bot_data["settings_commits"]
+    await commits.durable(commits.stage(json.dumps(context.bot_data["settings"], ensure_ascii=False, indent=2)))
+
+# отчёт один на всех: при смене дня заменяется только эта задача
+# report_day считается от понедельника, PTB — от воскресенья, переводит ptb_days
+def schedule_report(job_queue, settings):
+    for job in job_queue.get_jobs_by_name("weekly_report"):
+        job.schedule_removal()
+    days = ptb_days(1 << settings["report_day"])
+    job_queue.run_daily(daily_job(weekly_report, time(7,30)), time(7,30), days=days, name="weekly_report")
 
 # ---------------- Клавиатуры ----------------
-def main_keyboard():
-    keyboard = [
-        [KeyboardButton("Статистика"), KeyboardButton("Выпила!")],
-        [KeyboardButton("Настройки"), KeyboardButton("Тест уведомления")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def settings_keyboard():
-    keyboard = [
-        [KeyboardButton("Поменять день")],
-        [KeyboardButton("Назад")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def back_to_main_keyboard():
-    keyboard = [[KeyboardButton("Назад")]]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+# Собираются один раз при импорте, объекты telegram неизменяемые
+MAIN_KEYBOARD = ReplyKeyboardMarkup([
+    [KeyboardButton("Статистика"), KeyboardButton("Выпила!")],
+    [KeyboardButton("Настройки"), KeyboardButton("Тест уведомления")]
+], resize_keyboard=True)
 
-# ---------------- Хэндлеры ----------------
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Привет! Я помогу тебе не забывать таблетки.", reply_markup=main_keyboard())
+SETTINGS_KEYBOARD = ReplyKeyboardMarkup([
+    [KeyboardButton("Поменять день")],
+    [KeyboardButton("Назад")]
+], resize_keyboard=True)
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text
-    settings = context.bot_data.get("settings", load_settings())
+BACK_TO_MAIN_KEYBOARD = ReplyKeyboardMarkup([[KeyboardButton("Назад")]], resize_keyboard=True)
 
-    if text == "Статистика":
-        week, month = get_stats()
-        await update.message.reply_text(f"Таблетки за неделю: {week}\nТаблетки за месяц: {month}")
+DAYS = ["Понедельник","Вторник","Среда","Четверг","Пятница","Суббота","Воскресенье"]
+DAYS_DICT = {day: i for i, day in enumerate(DAYS)}
 
-    elif text == "Выпила!":
-        if record_today():
-            await update.message.reply_text("Зафиксировано!")
-        else:
-            await update.message.reply_text("Уже зафиксировано сегодня!")
-
-    elif text == "Настройки":
-        await update.message.reply_text("Выбери настройку:", reply_markup=settings_keyboard())
+DAYS_KEYBOARD = ReplyKeyboardMarkup([
+    [KeyboardButton(day) for day in DAYS[:4]],
+    [KeyboardButton(day) for day in DAYS[4:]],
+    [KeyboardButton("Назад")]
+], resize_keyboard=True)
 
-    elif text == "Поменять день":
-        days = ["Понедельник","Вторник","Среда","Четверг","Пятница","Суббота","Воскресенье"]
-        keyboard = [[KeyboardButton(day) for day in days[:4]],
-                    [KeyboardButton(day) for day in days[4:]],
-                    [KeyboardButton("Назад")]]
-        await update.message.reply_text("Выбери день недели для отчёта:", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        context.user_data["awaiting_day"] = True
+REMINDER_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("Выпила!", callback_data="done")]])
 
-    elif text == "Назад":
-        await update.message.reply_text("Возврат в главное меню", reply_markup=main_keyboard())
+# ---------------- Хэндлеры ----------------
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    settings = context.bot_data["settings"]
+    chat_ids = settings.setdefault("chat_ids", [])
+    if update.effective_chat.id not in chat_ids:
+        chat_ids.append(update.effective_chat.id)
+        await commit_settings(context)
+    await update.message.reply_text("Привет! Я помогу тебе не забывать таблетки.", reply_markup=MAIN_KEYBOARD)
+
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    week, month = await get_stats(context.bot_data["storage"])
+    await update.message.reply_text(f"Таблетки за неделю: {week}\nТаблетки за месяц: {month}")
+
+async def mark_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    added = await record_today(context.bot_data["storage"])
+    mark_completed(context, update.effective_chat.id)
+    if added:
+        await update.message.reply_text("Зафиксировано!")
+    else:
+        await update.message.reply_text("Уже зафиксировано сегодня!")
+
+async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Выбери настройку:", reply_markup=SETTINGS_KEYBOARD)
+
+async def change_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Выбери день недели для отчёта:", reply_markup=DAYS_KEYBOARD)
+    context.user_data["awaiting_day"] = True
+
+async def go_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Возврат в главное меню", reply_markup=MAIN_KEYBOARD)
+    context.user_data["awaiting_day"] = False
+
+@timed
+async def choose_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    if text in DAYS_DICT:
+        settings = context.bot_data["settings"]
+        settings["report_day"] = DAYS_DICT[text]
+        await commit_settings(context)
+        schedule_report(context.job_queue, settings)
         context.user_data["awaiting_day"] = False
+        await update.message.reply_text(f"День отчёта изменён на {text}", reply_markup=MAIN_KEYBOARD)
+    else:
+        await update.message.reply_text("Выбери день из списка")
+
+async def test_notification(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.message.chat_id
+    context.job_queue.run_once(send_today_reminder, when=3, data={"chat_id": chat_id})
+    await update.message.reply_text("Тестовое уведомление будет отправлено через 3 секунды.")
+
+# Кнопки ищутся в словаре, а не цепочкой if/elif
+ROUTES = {
+    "Статистика": timed(show_stats),
+    "Выпила!": timed(mark_done),
+    "Настройки": timed(show_settings),
+    "Поменять день": timed(change_day),
+    "Назад": timed(go_back),
+    "Тест уведомления": timed(test_notification),
+}
 
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    handler = ROUTES.get(update.message.text)
+    if handler:
+        await handler(update, context)
     elif context.user_data.get("awaiting_day"):
-        days_dict = {"Понедельник":0,"Вторник":1,"Среда":2,"Четверг":3,"Пятница":4,"Суббота":5,"Воскресенье":6}
-        if text in days_dict:
-            settings["report_day"] = days_dict[text]
-            save_settings(settings)
-            context.bot_data["settings"] = settings
-            context.user_data["awaiting_day"] = False
-            await update.message.reply_text(f"День отчёта изменён на {text}", reply_markup=main_keyboard())
-        else:
-            await update.message.reply_text("Выбери день из списка")
-
-    elif text == "Тест уведомления":
-        chat_id = update.message.chat_id
-        context.job_queue.run_once(send_today_reminder, when=3, data={"chat_id": chat_id})
-        await update.message.reply_text("Тестовое уведомление будет отправлено через 3 секунды.")
+        await choose_day(update, context)
 
 # ---------------- Inline кнопка "Выпила!" ----------------
+# без data (ежедневная задача) — всем из settings["chat_ids"], с data — одному чату (тест)
 async def send_today_reminder(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = context.job.data["chat_id"]
-    keyboard = [[InlineKeyboardButton("Выпила!", callback_data="done")]]
-    markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(chat_id, "💊 Напоминание: выпей таблетку сегодня!", reply_markup=markup)
+    if context.job.data:
+        chat_ids = [context.job.data["chat_id"]]
+    else:
+        chat_ids = list(context.bot_data["settings"].get("chat_ids", []))
+    messages = ((chat_id, "💊 Напоминание: выпей таблетку сегодня!") for chat_id in chat_ids)
+    await context.bot_data["broadcaster"].broadcast("daily_reminder", messages, reply_markup=REMINDER_MARKUP)
+
+# повтор через delay минут (job.data) чатам, которые ещё не нажали «Выпила!»
+async def send_follow_up(context: ContextTypes.DEFAULT_TYPE):
+    delay = context.job.data
+    day = (datetime.now() - timedelta(minutes=delay)).date()
+    chat_ids = context.bot_data["settings"].get("chat_ids", [])
+    pending = context.bot_data["completions"].pending(chat_ids, lambda chat_id: day)
+    messages = ((chat_id, "⏰ Таблетка сегодня ещё не отмечена!") for chat_id in pending)
+    await context.bot_data["broadcaster"].broadcast(f"follow_up_{delay}", messages, reply_markup=REMINDER_MARKUP)
 
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     if query.data == "done":
-        if record_today():
+        added = await record_today(context.bot_data["storage"])
+        mark_completed(context, update.effective_chat.id)
+        if added:
             await query.edit_message_text("Зафиксировано!")
         else:
             await query.edit_message_text("Уже зафиксировано сегодня!")
 
 # ---------------- Еженедельный отчёт ----------------
+# отметки общие, поэтому счётчики считаются один раз и один текст уходит всем чатам
 async def weekly_report(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = list(context.bot_data.keys())[0] if context.bot_data else None
-    if chat_id:
-        week, month = get_stats()
-        await context.bot.send_message(chat_id, f"Отчёт за неделю:\nТаблетки за неделю: {week}\nТаблетки за месяц: {month}")
+    chat_ids = list(context.bot_data["settings"].get("chat_ids", []))
+    if not chat_ids:
+        return
+    week, month = await get_stats(context.bot_data["storage"])
+    text = f"Отчёт за неделю:\nТаблетки за неделю: {week}\nТаблетки за месяц: {month}"
+    await context.bot_data["broadcaster"].broadcast("weekly_report", ((chat_id, text) for chat_id in chat_ids))
 
 # ---------------- Запуск ----------------
-def main():
-    import os
-    TOKEN = os.environ["TOKEN"]
-    app = ApplicationBuilder().token(TOKEN).build()
+async def on_shutdown(app):
+    app.bot_data["settings_commits"].close()
+    await close_storage(app)
+
+def build_app(token):
+    app = app_builder(token).post_shutdown(on_shutdown).build()
 
     settings = load_settings()
     app.bot_data["settings"] = settings
-
-    app.add_handler(CommandHandler("start", start))
+    app.bot_data["settings_commits"] = GroupCommit(write_settings, name="settings-commit")
+    storage = open_storage(layout="flat")
+    app.bot_data["storage"] = AsyncStorage(storage)
+    app.bot_data["broadcaster"] = Broadcaster(app.bot)
+    # отметка общая: если сегодня уже отмечено, повторы не нужны никому
+    app.bot_data["completions"] = DailyCompletions()
+    today = datetime.now().date()
+    if storage.count_range(FLAT_USER, today, today):
+        app.bot_data["completions"].load(today, settings.get("chat_ids", []))
+    app.bot_data["completions"].start_rollover(app.job_queue)
+
+    app.add_handler(CommandHandler("start", timed(start)))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    app.add_handler(CallbackQueryHandler(callback_query_handler))
+    app.add_handler(CallbackQueryHandler(timed(callback_query_handler)))
+    # повторные нажатия «Выпила!» под напоминанием и дубли callback-запросов отсекаются здесь
+    install_admission(app, low_priority={"Статистика"})
 
     # --- JobQueue: стандартное ежедневное уведомление в 7:30 ---
-    app.job_queue.run_daily(send_today_reminder, time(7,30), name="daily_reminder")
+    app.job_queue.run_daily(daily_job(send_today_reminder, time(7,30)), time(7,30), name="daily_reminder")
+    for delay in FOLLOW_UPS:
+        at = time((7 * 60 + 30 + delay) // 60 % 24, (30 + delay) % 60)
+        app.job_queue.run_daily(daily_job(send_follow_up, at), at, data=delay, name=f"follow_up_{delay}")
     # --- Еженедельный отчёт ---
-    app.job_queue.run_daily(weekly_report, time(7,30), days=(settings["report_day"],), name="weekly_report")
+    schedule_report(app.job_queue, settings)
 
-    app.run_polling()
+    install_metrics(app)
+    return app
+
+def main():
+    run(build_app(os.environ["TOKEN"]))
 
 if __name__ == "__main__":
     main()
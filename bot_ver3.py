@@ -1,32 +1,34 @@
 import os
 import json
-from datetime import datetime, timedelta, time as dt_time
+import time
+import asyncio
+from functools import partial
+from datetime import datetime, timedelta
+import pytz
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import (
-    ApplicationBuilder, ContextTypes, CommandHandler,
+    ContextTypes, CommandHandler,
     MessageHandler, filters, ConversationHandler
 )
+from storage import AsyncStorage, open_storage, close_storage
+from webhook import run, app_builder
+from broadcast import Broadcaster, GLOBAL_RATE
+from scheduler import SlotScheduler
+from sharding import run_sharded, shard_of
+from router import TextRouter, ExactText
+from metrics import timed, install as install_metrics
+from concurrency import PerUserUpdateProcessor
+from admission import install as install_admission
+from user_settings import DEFAULT_TZ, UserSettingsStore
+from completions import FOLLOW_UPS, DailyCompletions, local_today
+from datafile import csv_document
 
-DATA_FILE = "data.json"
 SETTINGS_FILE = "settings.json"
 
 # --- состояния для ConversationHandler ---
 SET_TIME, SET_DAY = range(2)
 
-# --- загрузка и сохранение данных ---
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {}
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-def save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
+# --- загрузка и сохранение настроек ---
 def load_settings():
     default = {"hour": 7, "minute": 30, "report_day": 0}  # понедельник по умолчанию
     if not os.path.exists(SETTINGS_FILE):
@@ -41,97 +43,103 @@ def save_settings(settings):
     with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
         json.dump(settings, f, ensure_ascii=False, indent=2)
 
-# --- главное меню ---
-def main_menu():
-    keyboard = [
-        [KeyboardButton("📊 Статистика"), KeyboardButton("💊 Выпила!")],
-        [KeyboardButton("⚙ Настройки")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-# --- настройки ---
-def settings_menu():
-    keyboard = [
-        [KeyboardButton("⏰ Поменять время"), KeyboardButton("📅 Поменять день отчёта")],
-        [KeyboardButton("🗑 Обнулить все")],
-        [KeyboardButton("🔙 Назад")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+# --- настройки конкретного пользователя, общие настройки — значения по умолчанию ---
+# Читаются из bot_data["user_settings"] (UserSettingsStore), после загрузки — без обращения к диску;
+# изменение через update() само перепланирует напоминание и отчёт этого пользователя.
+def user_defaults():
+    settings = load_settings()
+    return {"hour": settings["hour"], "minute": settings["minute"], "report_day": settings["report_day"], "tz": DEFAULT_TZ}
+
+# напоминание каждый день, повторы через FOLLOW_UPS минут и отчёт в report_day, всё во время пользователя
+# slots — кэши SlotScheduler.schedule по имени планировщика для массовой загрузки
+def schedule_user(bot_data, chat_id, settings, slots=None):
+    hour, minute, tz = settings["hour"], settings["minute"], settings["tz"]
+
+    def cache(scheduler):
+        return slots.setdefault(scheduler.name, {}) if slots is not None else None
+
+    reminders, reports = bot_data["reminders"], bot_data["reports"]
+    reminders.schedule(chat_id, hour, minute, tz, slots=cache(reminders))
+    reports.schedule(chat_id, hour, minute, tz, 1 << settings["report_day"], slots=cache(reports))
+    for delay, follow_ups in bot_data["follow_ups"].items():
+        at = (hour * 60 + minute + delay) % (24 * 60)
+        follow_ups.schedule(chat_id, at // 60, at % 60, tz, slots=cache(follow_ups))
+
+# --- клавиатуры: собираются один раз, объекты telegram неизменяемые ---
+MAIN_MENU = ReplyKeyboardMarkup([
+    [KeyboardButton("📊 Статистика"), KeyboardButton("💊 Выпила!")],
+    [KeyboardButton("⚙ Настройки")]
+], resize_keyboard=True)
+
+SETTINGS_MENU = ReplyKeyboardMarkup([
+    [KeyboardButton("⏰ Поменять время"), KeyboardButton("📅 Поменять день отчёта")],
+    [KeyboardButton("🗑 Обнулить все")],
+    [KeyboardButton("🔙 Назад")]
+], resize_keyboard=True)
+
+BACK_MENU = ReplyKeyboardMarkup([["🔙 Назад"]], resize_keyboard=True)
+
+REMINDER_MENU = ReplyKeyboardMarkup([[KeyboardButton("💊 Выпила!")]], resize_keyboard=True)
 
 # --- команды ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Привет! Я буду напоминать тебе пить таблетки 💊",
-        reply_markup=main_menu()
+        reply_markup=MAIN_MENU
     )
 
 # --- статистика ---
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = load_data()
+    storage = context.bot_data["storage"]
     user = str(update.effective_user.id)
-    today = datetime.now().date()
-    week_count = 0
-    month_count = 0
-    if user in data:
-        for date_str in data[user]:
-            dt = datetime.strptime(date_str, "%Y-%m-%d").date()
-            if (today - dt).days < 7:
-                week_count += 1
-            if dt.month == today.month:
-                month_count += 1
-    await update.message.reply_text(f"📅 За последнюю неделю: {week_count}\n🗓 За текущий месяц: {month_count}")
+    tz = (await context.bot_data["user_settings"].get(update.effective_chat.id))["tz"]
+    summary = await storage.summary(user, local_today(tz))
+    last = summary["last"].strftime("%d.%m.%Y") if summary["last"] else "—"
+    await update.message.reply_text(
+        f"📅 За последнюю неделю: {summary['week']}\n"
+        f"🗓 За текущий месяц: {summary['month']}\n"
+        f"🔥 Серия: {summary['streak']} дн. (рекорд: {summary['longest']})\n"
+        f"✅ За 30 дней: {summary['adherence30']}%, за 90 дней: {summary['adherence90']}%\n"
+        f"🕓 Последняя отметка: {last}"
+    )
+
+# --- меню настроек ---
+async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("⚙ Настройки:", reply_markup=SETTINGS_MENU)
 
 # --- фиксируем 'выпила' ---
 async def mark_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = load_data()
+    storage = context.bot_data["storage"]
     user = str(update.effective_user.id)
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    if user not in data:
-        data[user] = []
-    if today_str in data[user]:
-        await update.message.reply_text("✅ Уже зафиксировано!")
-    else:
-        data[user].append(today_str)
-        save_data(data)
+    chat_id = update.effective_chat.id
+    tz = (await context.bot_data["user_settings"].get(chat_id))["tz"]
+    # отметка в хранилище — за тот же местный день, что и в completions (и при засеве на старте)
+    today = local_today(tz)
+    context.bot_data["completions"].mark(chat_id, today)
+    if await storage.record_today(user, today):
         await update.message.reply_text("✅ Зафиксировано!")
+    else:
+        await update.message.reply_text("✅ Уже зафиксировано!")
         
 # --- настройки времени ---
 async def change_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Введите новое время напоминания (ЧЧ:ММ):", reply_markup=ReplyKeyboardMarkup([["🔙 Назад"]], resize_keyboard=True))
+    await update.message.reply_text("Введите новое время напоминания (ЧЧ:ММ):", reply_markup=BACK_MENU)
     return SET_TIME
 
 async def save_new_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         new_time = datetime.strptime(update.message.text, "%H:%M").time()
-        settings = load_settings()
-        settings["hour"] = new_time.hour
-        settings["minute"] = new_time.minute
-        save_settings(settings)
-        await update.message.reply_text(f"✅ Время напоминания изменено на {new_time.strftime('%H:%M')}", reply_markup=main_menu())
-
-        # --- обновляем задачу на сегодня ---
-        job_queue = context.job_queue
-        chat_id = update.effective_chat.id
-        # удаляем старую задачу
-        for job in job_queue.get_jobs_by_name(f"reminder_{chat_id}"):
-            job.schedule_removal()
-
-        # добавляем новую ежедневную задачу
-        job_queue.run_daily(
-            daily_reminder,
-            time=new_time,
-            name=f"reminder_{chat_id}",
-            chat_id=chat_id
-        )
-
+        # пользователь переносится в слот нового времени подпиской на изменения
+        await context.bot_data["user_settings"].update(update.effective_chat.id, hour=new_time.hour, minute=new_time.minute)
+        await update.message.reply_text(f"✅ Время напоминания изменено на {new_time.strftime('%H:%M')}", reply_markup=MAIN_MENU)
     except ValueError:
-        await update.message.reply_text("⚠ Неверный формат. Введи время в формате ЧЧ:ММ.", reply_markup=ReplyKeyboardMarkup([["🔙 Назад"]], resize_keyboard=True))
+        await update.message.reply_text("⚠ Неверный формат. Введи время в формате ЧЧ:ММ.", reply_markup=BACK_MENU)
         return SET_TIME
     return ConversationHandler.END
 
 # --- настройки дня отчёта ---
 async def change_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Введите новый день недели для отчета (0-Пн ... 6-Вс):", reply_markup=ReplyKeyboardMarkup([["🔙 Назад"]], resize_keyboard=True))
+    await update.message.reply_text("Введите новый день недели для отчета (0-Пн ... 6-Вс):", reply_markup=BACK_MENU)
     return SET_DAY
 
 async def save_new_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -139,134 +147,230 @@ async def save_new_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
         day = int(update.message.text)
         if day not in range(7):
             raise ValueError
-        settings = load_settings()
-        settings["report_day"] = day
-        save_settings(settings)
-        await update.message.reply_text(f"✅ День отчета изменен на {day}", reply_markup=main_menu())
+        await context.bot_data["user_settings"].update(update.effective_chat.id, report_day=day)
+        await update.message.reply_text(f"✅ День отчета изменен на {day}", reply_markup=MAIN_MENU)
     except ValueError:
-        await update.message.reply_text("⚠ Введи число от 0 (Пн) до 6 (Вс).", reply_markup=ReplyKeyboardMarkup([["🔙 Назад"]], resize_keyboard=True))
+        await update.message.reply_text("⚠ Введи число от 0 (Пн) до 6 (Вс).", reply_markup=BACK_MENU)
         return SET_DAY
     return ConversationHandler.END
 
 # --- обнуление всех записей ---
 async def reset_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = load_data()
+    storage = context.bot_data["storage"]
+    user = str(update.effective_user.id)
+    await storage.reset(user)
+    await update.message.reply_text("♻ Все записи обнулены!", reply_markup=MAIN_MENU)
+
+# --- часовой пояс: /tz Europe/Moscow ---
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args or context.args[0] not in pytz.all_timezones_set:
+        await update.message.reply_text("Укажи часовой пояс, например: /tz Europe/Moscow")
+        return
+    settings = await context.bot_data["user_settings"].update(update.effective_chat.id, tz=context.args[0])
+    await update.message.reply_text(f"✅ Часовой пояс: {settings['tz']}", reply_markup=MAIN_MENU)
+
+# --- выгрузка своей истории в CSV: /export ---
+async def export_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = str(update.effective_user.id)
-    if user in data:
-        data[user] = []
-        save_data(data)
-    await update.message.reply_text("♻ Все записи обнулены!", reply_markup=main_menu())
+    dates = await context.bot_data["storage"].get_dates(user)
+    await update.message.reply_document(csv_document(dates), filename=f"pills_{user}.csv", caption=f"Отметок: {len(dates)}")
 
 # --- кнопка назад ---
 async def go_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await start(update, context)
     return ConversationHandler.END
 
-# --- ежедневное уведомление ---
+# --- ежедневное уведомление: один вызов на слот со всеми его чатами ---
+async def send_reminders(context: ContextTypes.DEFAULT_TYPE, chat_ids):
+    messages = ((chat_id, "💊 Выпей таблетку!") for chat_id in chat_ids)
+    await context.bot_data["broadcaster"].broadcast("daily_reminder", messages, reply_markup=REMINDER_MENU)
+
+# --- повтор через delay минут тем из слота, кто ещё не отметился ---
+async def send_follow_ups(context: ContextTypes.DEFAULT_TYPE, chat_ids, delay):
+    user_time = context.bot_data["reminders"].user_time
+    dates = {}  # tz -> дата напоминания, к которому относится повтор
+
+    def day_of(chat_id):
+        tz = user_time[chat_id][2] if chat_id in user_time else DEFAULT_TZ
+        if tz not in dates:
+            dates[tz] = local_today(tz, delay)
+        return dates[tz]
+
+    pending = context.bot_data["completions"].pending(chat_ids, day_of)
+    messages = ((chat_id, "⏰ Таблетка сегодня ещё не отмечена. Выпей и нажми «💊 Выпила!»") for chat_id in pending)
+    await context.bot_data["broadcaster"].broadcast(f"follow_up_{delay}", messages, reply_markup=REMINDER_MENU)
+
+# --- еженедельный отчёт ---
+# счётчики считаются пачкой (batch_stats), а не запросом на каждого пользователя;
+# в слоте бывают разные часовые пояса, а отметки хранятся по местной дате —
+# поэтому пачка на каждый пояс со своим «сегодня», как у повторов
+async def send_reports(context: ContextTypes.DEFAULT_TYPE, chat_ids):
+    from batch_stats import BatchStats  # numpy — только когда дошло до отчётов
+
+    storage = context.bot_data["storage"].storage
+    user_time = context.bot_data["reports"].user_time
+    by_tz = {}
+    for chat_id in chat_ids:
+        tz = user_time[chat_id][2] if chat_id in user_time else DEFAULT_TZ
+        by_tz.setdefault(tz, []).append(str(chat_id))
+    messages = []
+    for tz, users in by_tz.items():
+        stats = await asyncio.to_thread(BatchStats.load, storage, users)
+        messages.extend(
+            (int(user), f"📈 Отчёт за неделю:\n📅 За последнюю неделю: {week}\n🗓 За текущий месяц: {month}\n"
+                        f"✅ Соблюдение режима: {adherence}%\n💊 Всего: {total}")
+            for user, week, month, total, adherence in stats.rows(local_today(tz))
+        )
+    await context.bot_data["broadcaster"].broadcast("weekly_report", messages)
+
+# --- тестовое уведомление одному чату ---
 async def daily_reminder(context: ContextTypes.DEFAULT_TYPE):
     job = context.job
     chat_id = getattr(job, 'chat_id', None)
     if chat_id is None:
         return
-    await context.bot.send_message(chat_id, "💊 Выпей таблетку!", reply_markup=ReplyKeyboardMarkup([[KeyboardButton("💊 Выпила!")]], resize_keyboard=True))
+    await context.bot.send_message(chat_id, "💊 Выпей таблетку!", reply_markup=REMINDER_MENU)
 
 # --- тестовое уведомление ---
 async def test_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await context.job_queue.run_once(daily_reminder, datetime.now() + timedelta(seconds=3), chat_id=update.effective_chat.id)
+    context.job_queue.run_once(daily_reminder, 3, chat_id=update.effective_chat.id)
     await update.message.reply_text("⏱ Тестовое уведомление через 3 секунды.")
 
-# --- основная функция ---
-def main():
-    TOKEN = os.environ.get("TOKEN")
-    if not TOKEN:
-        print("⚠ Поставь токен в переменной окружения TOKEN")
-        return
+# --- /start: запоминаем пользователя и ставим ему напоминание и отчёт ---
+async def start_and_save_chat_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    if chat_id not in context.bot_data["reminders"]:
+        # сохраняем значения по умолчанию, подписка ставит напоминание и отчёт
+        await context.bot_data["user_settings"].update(chat_id)
+    await start(update, context)
+
+# --- восстановление расписаний всех пользователей за один проход по user_settings.jsonl ---
+# Идёт фоном: опрос обновлений стартует сразу, и первый ответ не ждёт чтения файла
+# и планирования всех пользователей. До конца загрузки UserSettingsStore.get()
+# читает настройки пользователя из файла сам, в потоке, а update() планирует его подпиской.
+RESTORE_CHUNK = 1000  # столько пользователей планируется между уступками циклу событий
+
+async def on_startup(app):
+    task = app.bot_data["restore_task"] = asyncio.create_task(restore_schedules(app))
+    task.add_done_callback(report_restore_failure)
+
+# задачу никто не ждёт: без этого её ошибка молча остановила бы всё планирование
+def report_restore_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"⚠ Восстановление расписаний прервано: {task.exception()!r}")
+
+async def restore_schedules(app):
+    started = time.perf_counter()
+    store = app.bot_data["user_settings"]
+    index, count = app.bot_data["shard"]
+    store.merge(await asyncio.to_thread(store.read, lambda chat_id: shard_of(chat_id, count) == index))
+    slots = {}
+    for i, (chat_id, settings) in enumerate(list(store.items())):
+        # одна испорченная запись (например, неизвестный часовой пояс) не мешает остальным
+        try:
+            schedule_user(app.bot_data, chat_id, settings, slots)
+        except Exception as e:
+            print(f"⚠ Не удалось запланировать {chat_id}: {e!r}")
+        if i % RESTORE_CHUNK == RESTORE_CHUNK - 1:
+            await asyncio.sleep(0)
+
+    # отметки за вчера, сегодня и завтра по UTC покрывают «сегодня» во всех поясах
+    storage = app.bot_data["storage"].storage
+    utc_today = datetime.now(pytz.utc).date()
+    for day in (utc_today - timedelta(days=1), utc_today, utc_today + timedelta(days=1)):
+        users = await asyncio.to_thread(storage.users_marked_on, day)
+        app.bot_data["completions"].load(day, (int(user) for user in users if user.lstrip("-").isdigit()))
+
+    # chat_id из settings.json — пользователь старой однопользовательской версии
+    legacy_chat_id = load_settings().get("chat_id")
+    if legacy_chat_id is not None and legacy_chat_id not in app.bot_data["reminders"] \
+            and shard_of(legacy_chat_id, count) == index:
+        schedule_user(app.bot_data, legacy_chat_id, store.defaults)
+
+    app.bot_data["startup_seconds"] = time.perf_counter() - started
+    print(f"Восстановлены расписания {len(app.bot_data['reminders'])} пользователей за {app.bot_data['startup_seconds']:.2f} с")
+
+# --- остановка: дописать очереди настроек и хранилища ---
+async def on_shutdown(app):
+    app.bot_data["restore_task"].cancel()
+    app.bot_data["user_settings"].close()
+    await close_storage(app)
+
+# --- сборка приложения; shard = (номер, всего) в многопроцессном режиме ---
+def build_app(token, shard=(0, 1)):
+    # разные пользователи — параллельно, один пользователь — по очереди (concurrency.py)
+    app = app_builder(token).concurrent_updates(PerUserUpdateProcessor()) \
+        .post_init(on_startup).post_shutdown(on_shutdown).build()
+    app.bot_data["shard"] = shard
+    app.bot_data["storage"] = AsyncStorage(open_storage())
+    # лимит Telegram общий на бота, делим его между воркерами
+    app.bot_data["broadcaster"] = Broadcaster(app.bot, global_rate=GLOBAL_RATE / shard[1])
+    app.bot_data["reminders"] = SlotScheduler(app.job_queue, send_reminders, "reminder")
+    app.bot_data["reports"] = SlotScheduler(app.job_queue, send_reports, "report")
+    app.bot_data["follow_ups"] = {
+        delay: SlotScheduler(app.job_queue, partial(send_follow_ups, delay=delay), f"follow_up_{delay}")
+        for delay in FOLLOW_UPS
+    }
+    app.bot_data["completions"] = DailyCompletions()
+    app.bot_data["completions"].start_rollover(app.job_queue)
+    for scheduler in (app.bot_data["reminders"], app.bot_data["reports"], *app.bot_data["follow_ups"].values()):
+        scheduler.start_refresh()
+    app.bot_data["user_settings"] = UserSettingsStore(user_defaults())
+    app.bot_data["user_settings"].subscribe(
+        lambda chat_id, settings: schedule_user(app.bot_data, chat_id, settings)
+    )
 
-    app = ApplicationBuilder().token(TOKEN).build()
+    # --- кнопки: текст -> обработчик ---
+    main_router = TextRouter({
+        "💊 Выпила!": mark_done,
+        "📊 Статистика": show_stats,
+        "⚙ Настройки": show_settings,
+        "⏱ Тестовое уведомление": test_reminder,
+    })
+    settings_router = TextRouter({
+        "⏰ Поменять время": change_time,
+        "📅 Поменять день отчёта": change_day,
+        "🗑 Обнулить все": reset_all,
+    })
+    back_router = TextRouter({"🔙 Назад": go_back})
+    # ввод времени или дня — любой текст, кроме «Назад», который уходит в fallbacks
+    user_input = filters.TEXT & ~filters.COMMAND & ~ExactText(back_router.routes)
 
     conv_handler = ConversationHandler(
-        entry_points=[
-            MessageHandler(filters.Regex("⏰ Поменять время"), change_time),
-            MessageHandler(filters.Regex("📅 Поменять день отчёта"), change_day),
-            MessageHandler(filters.Regex("🗑 Обнулить все"), reset_all)
-        ],
+        entry_points=[settings_router.handler()],
         states={
-            SET_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_time)],
-            SET_DAY: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_day)],
+            SET_TIME: [MessageHandler(user_input, timed(save_new_time))],
+            SET_DAY: [MessageHandler(user_input, timed(save_new_day))],
         },
-        fallbacks=[MessageHandler(filters.Regex("🔙 Назад"), go_back)]
+        fallbacks=[back_router.handler()]
     )
 
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(MessageHandler(filters.Regex("💊 Выпила!"), mark_done))
-    app.add_handler(MessageHandler(filters.Regex("📊 Статистика"), show_stats))
-    app.add_handler(MessageHandler(filters.Regex("⚙ Настройки"), lambda u, c: u.message.reply_text("⚙ Настройки:", reply_markup=settings_menu())))
-    app.add_handler(MessageHandler(filters.Regex("⏱ Тестовое уведомление"), test_reminder))
+    app.add_handler(CommandHandler("start", timed(start_and_save_chat_id)))
+    app.add_handler(CommandHandler("tz", timed(set_timezone)))
+    app.add_handler(CommandHandler("export", timed(export_history)))
+    app.add_handler(main_router.handler())
     app.add_handler(conv_handler)
+    install_admission(app, low_priority={"📊 Статистика", "/export"})
+    install_metrics(app, port_offset=shard[0])
+    return app
 
-    # --- получаем ID пользователя для запуска уведомлений ---
-    # Здесь просто запускаем ежедневное напоминаение на 7:30 пользователю,
-    # который написал /start (инициализация)
-    # Для удобства, можно задать chat_id вручную или получить с первого взаимодействия
-
-    # Для первого запуска можно использовать заглушку,
-    # и поменять после получения chat_id пользователя. Пока оставим None и запустим с задержкой.
-
-    # Запускаем polling асинхронно и потом добавим работу с задачами
-    async def on_startup(app):
-        settings = load_settings()
-        hour, minute = settings["hour"], settings["minute"]
-
-        # Для одного пользователя:
-        # Нужно проверить, что у вас где-то сохранён chat_id.
-        # Предположим, что chat_id хранится в файле settings.json как "chat_id"
-        chat_id = settings.get("chat_id")
-        if chat_id is None:
-            print("⚠ Не найден chat_id в настройках, уведомления не запущены")
-            return
-
-        # Очистим старые задачи на этого пользователя
-        for job in app.job_queue.get_jobs_by_name(f"reminder_{chat_id}"):
-            job.schedule_removal()
-
-        app.job_queue.run_daily(
-            daily_reminder,
-            time=dt_time(hour=hour, minute=minute),
-            name=f"reminder_{chat_id}",
-            chat_id=chat_id
-        )
-
-    app.post_init = on_startup
-
-    # --- дополнительно, обработчик /start для сохранения chat_id ---
-    async def start_and_save_chat_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        chat_id = update.effective_chat.id
-        settings = load_settings()
-        if settings.get("chat_id") != chat_id:
-            settings["chat_id"] = chat_id
-            save_settings(settings)
-            # После сохранения chat_id, создаём задачу если нужно
-            hour, minute = settings["hour"], settings["minute"]
-            for job in context.job_queue.get_jobs_by_name(f"reminder_{chat_id}"):
-                job.schedule_removal()
-            context.job_queue.run_daily(
-                daily_reminder,
-                time=dt_time(hour=hour, minute=minute),
-                name=f"reminder_{chat_id}",
-                chat_id=chat_id
-            )
-        await start(update, context)
-
-    # Перерегистрируем handler start, чтобы сохранять chat_id
-    app.handlers.clear()
-    app.add_handler(CommandHandler("start", start_and_save_chat_id))
-    app.add_handler(MessageHandler(filters.Regex("💊 Выпила!"), mark_done))
-    app.add_handler(MessageHandler(filters.Regex("📊 Статистика"), show_stats))
-    app.add_handler(MessageHandler(filters.Regex("⚙ Настройки"), lambda u, c: u.message.reply_text("⚙ Настройки:", reply_markup=settings_menu())))
-    app.add_handler(MessageHandler(filters.Regex("⏱ Тестовое уведомление"), test_reminder))
-    app.add_handler(conv_handler)
+# --- основная функция ---
+def main():
+    TOKEN = os.environ.get("TOKEN")
+    if not TOKEN:
+        print("⚠ Поставь токен в переменной окружения TOKEN")
+        return
 
-    app.run_polling()
+    workers = int(os.environ.get("WORKERS", "1"))
+    if workers > 1:
+        if os.environ.get("STORAGE", "sqlite") != "sqlite":
+            print("⚠ Для WORKERS > 1 нужно хранилище SQLite (STORAGE=sqlite)")
+            return
+        # перенос data.json делаем один раз до запуска воркеров
+        open_storage().close()
+        run_sharded(TOKEN, workers, build_app)
+    else:
+        run(build_app(TOKEN))
 
 if __name__ == "__main__":
     main()
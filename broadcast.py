@@ -0,0 +1,151 @@
+import time
+import random
+import asyncio
+
+from telegram.error import RetryAfter, NetworkError, TimedOut, Forbidden, BadRequest
+
+import metrics
+
+# --- рассылка напоминаний и отчётов ---
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат.
+GLOBAL_RATE = 30
+CHAT_INTERVAL = 1.0
+CONCURRENCY = 30
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        # RetryAfter от Telegram останавливает всех отправителей, а не один запрос
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # без ожидания: False, если токена сейчас нет (входящие запросы не ждут, а отбрасываются)
+    def try_acquire(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    # полон — значит давно не использовался
+    def idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastStats:
+    def __init__(self, name):
+        self.name = name
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies = []
+        self.started = time.monotonic()
+        self.duration = 0.0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def summary(self):
+        return (
+            f"[{self.name}] доставлено: {self.delivered}, ошибок: {self.failed}, повторов: {self.retries}, "
+            f"за {self.duration:.1f} с, задержка p50={self.percentile(0.5):.3f} с p99={self.percentile(0.99):.3f} с"
+        )
+
+
+class Broadcaster:
+    def __init__(self, bot, concurrency=CONCURRENCY, global_rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(global_rate)
+        self.chat_interval = chat_interval
+        self.chat_sent = {}  # chat_id -> время последней отправки
+
+    async def _wait_chat(self, chat_id):
+        last = self.chat_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self.chat_sent[chat_id] = time.monotonic()
+
+    async def send(self, chat_id, text, stats=None, **kwargs):
+        started = time.monotonic()
+        job = stats.name if stats else "send"
+        for attempt in range(MAX_ATTEMPTS):
+            await self._wait_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+            except RetryAfter as e:
+                self.bucket.pause(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                # бот заблокирован или чат не существует — повтор не поможет
+                print(f"⚠ Не отправлено в {chat_id}: {e}")
+                break
+            except (TimedOut, NetworkError) as e:
+                await asyncio.sleep(BACKOFF_BASE * 2 ** attempt * (1 + random.random()))
+            else:
+                metrics.send_result(job, "delivered")
+                if stats:
+                    stats.delivered += 1
+                    stats.latencies.append(time.monotonic() - started)
+                return True
+            if attempt + 1 < MAX_ATTEMPTS:
+                metrics.send_result(job, "retry")
+                if stats:
+                    stats.retries += 1
+        metrics.send_result(job, "failed")
+        if stats:
+            stats.failed += 1
+        return False
+
+    # messages — итерируемое из пар (chat_id, text); читается по мере отправки
+    async def broadcast(self, name, messages, **kwargs):
+        stats = BroadcastStats(name)
+        messages = iter(messages)
+
+        async def worker():
+            for chat_id, text in messages:
+                await self.send(chat_id, text, stats, **kwargs)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        stats.duration = time.monotonic() - stats.started
+        self._forget_idle_chats()
+        print(stats.summary())
+        return stats
+
+    def _forget_idle_chats(self):
+        cutoff = time.monotonic() - self.chat_interval
+        self.chat_sent = {c: t for c, t in self.chat_sent.items() if t > cutoff}
@@ -0,0 +1,54 @@
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, time
+
+import pytz
+
+# --- кто уже отметился сегодня: множество chat_id на каждый день ---
+# Обновляется в mark_done и по кнопке под напоминанием. Повторные напоминания
+# («ещё не выпила») получают чаты слота минус это множество — разность множеств
+# по размеру слота, без чтения истории. День у каждого пользователя свой, местный:
+# ключ — его дата, поэтому полночь в любом поясе просто начинает новое множество,
+# а rollover раз в сутки выбрасывает прошедшие дни.
+# FOLLOW_UPS — через сколько минут после напоминания повторить его, через запятую.
+FOLLOW_UPS = tuple(int(m) for m in os.environ.get("FOLLOW_UPS", "60,180").split(",") if m.strip())
+
+
+def local_today(tz, minutes_ago=0):
+    # дата у пользователя minutes_ago минут назад: повтор в 01:00 относится к напоминанию вчерашнего дня
+    return (datetime.now(pytz.timezone(tz)) - timedelta(minutes=minutes_ago)).date()
+
+
+class DailyCompletions:
+    def __init__(self):
+        self.days = {}  # date -> set(chat_id)
+
+    def mark(self, chat_id, day):
+        self.days.setdefault(day, set()).add(chat_id)
+
+    def load(self, day, chat_ids):
+        self.days.setdefault(day, set()).update(chat_ids)
+
+    def done(self, chat_id, day):
+        return chat_id in self.days.get(day, ())
+
+    # day_of(chat_id) -> дата пользователя; чаты группируются по дате, дальше — разность множеств
+    def pending(self, chat_ids, day_of):
+        groups = defaultdict(set)
+        for chat_id in chat_ids:
+            groups[day_of(chat_id)].add(chat_id)
+        result = []
+        for day, group in groups.items():
+            result.extend(group - self.days.get(day, set()))
+        return result
+
+    def rollover(self, keep_from):
+        for day in [day for day in self.days if day < keep_from]:
+            del self.days[day]
+
+    # в самых восточных поясах уже завтра, в самых западных ещё вчера — храним от вчерашней даты UTC
+    async def _rollover_job(self, context):
+        self.rollover(datetime.now(pytz.utc).date() - timedelta(days=1))
+
+    def start_rollover(self, job_queue):
+        job_queue.run_daily(self._rollover_job, time(0, 5, tzinfo=pytz.utc), name="completions_rollover")
@@ -0,0 +1,73 @@
+import os
+import sys
+import asyncio
+from contextlib import asynccontextmanager
+
+from telegram.ext import BaseUpdateProcessor
+
+from sharding import route_key
+
+# --- параллельная обработка обновлений с очередью на каждого пользователя ---
+# Обновления разных пользователей обрабатываются одновременно (до CONCURRENT_UPDATES штук),
+# обновления одного чата — строго по одному и по порядку, как при обычной обработке.
+# Так состояние ConversationHandler и пары «прочитать — изменить — записать» внутри
+# одного пользователя не пересекаются, а ожидание сети у одного не держит остальных.
+# Записи разных пользователей хранилища сливают сами: SQLite и журнал событий пишут
+# отдельные строки под своей блокировкой, не переписывая файл целиком.
+# CONCURRENT_UPDATES=1 возвращает последовательную обработку.
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "64"))
+
+
+class KeyedLocks:
+    def __init__(self):
+        self.locks = {}  # ключ -> [asyncio.Lock, сколько задач держат или ждут]
+
+    def __len__(self):
+        return len(self.locks)
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = self.locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            # последний ушедший убирает блокировку, словарь не растёт с числом пользователей
+            if not entry[1]:
+                del self.locks[key]
+
+
+# process_update (в PTB он final) берёт семафор базового класса ещё до do_process_update.
+# Ограничивай он число обновлений, очередь одного чата, ждущая своей блокировки, занимала бы
+# места, и чужие чаты стояли бы за ней. Поэтому базовому классу лимит не передаётся, а свой
+# семафор slots берётся уже под блокировкой чата: место занимает только то, что обрабатывается.
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=CONCURRENT_UPDATES):
+        # при 1 PTB обрабатывает обновления по одному, не создавая задач
+        super().__init__(1 if max_concurrent_updates == 1 else sys.maxsize)
+        self.slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.locks = KeyedLocks()
+        self.in_flight = 0  # принятые обновления: ждут блокировки, места или обрабатываются
+
+    async def do_process_update(self, update, coroutine):
+        self.in_flight += 1
+        try:
+            key = route_key(update) if hasattr(update, "effective_chat") else None
+            if key is None:
+                async with self.slots:
+                    await coroutine
+                return
+            async with self.locks.hold(key), self.slots:
+                await coroutine
+        finally:
+            self.in_flight -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,186 @@
+import io
+import os
+import csv
+import sys
+import json
+from datetime import date
+
+from storage import FLAT_USER, DATA_FILE, DB_FILE, parse_day
+
+# --- потоковое чтение и перенос data.json ---
+# data.json читается кусками по CHUNK_SIZE: JSONDecoder.raw_decode разбирает ключ и
+# значение верхнего уровня по одному, в памяти — только текущий кусок и список дат
+# одного пользователя. Формат определяется по первому значению: список — "users"
+# (bot.py, bot_ver3.py; в bot.py бывают повторы дат), true/false — "flat" (bot_ver2.py).
+# Запуск:
+#   python datafile.py import [data.json] [data.db]    — перенос в SQLite
+#   python datafile.py dump [data.db] [data.json]      — обратно в data.json формата "users"
+#   python datafile.py export user_id [data.db] [out.csv] — история пользователя в CSV
+CHUNK_SIZE = 1 << 16
+BATCH_ROWS = 10000
+FLAT_BATCH = 1000
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _more(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # уже разобранное начало буфера больше не нужно
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Ожидался {char!r} в позиции {self.f.tell()}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._more():
+                    continue
+                raise
+            # значение упёрлось в конец куска — число или литерал могли обрезаться, дочитываем
+            if end == len(self.buf) and not self.eof and self._more():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_items(path, chunk_size=CHUNK_SIZE):
+    # пары (ключ, значение) объекта верхнего уровня по порядку
+    with open(path, "r", encoding="utf-8") as f:
+        reader = _Reader(f, chunk_size)
+        if reader.peek() == "":
+            return
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            yield key, reader.value()
+            if reader.peek() == "}":
+                return
+            reader.expect(",")
+
+
+# (user, [уникальные даты по порядку]) — в формате "users" по пользователю,
+# в плоском — пачками по FLAT_BATCH дат для FLAT_USER
+def iter_json_marks(path, chunk_size=CHUNK_SIZE):
+    batch = []
+    for key, value in iter_json_items(path, chunk_size):
+        if isinstance(value, list):
+            yield key, sorted(set(value))
+        elif value:
+            batch.append(key)
+            if len(batch) >= FLAT_BATCH:
+                yield FLAT_USER, batch
+                batch = []
+    if batch:
+        yield FLAT_USER, batch
+
+
+def detect_file_layout(path):
+    for _, value in iter_json_items(path):
+        return "users" if isinstance(value, list) else "flat"
+    return "users"
+
+
+# --- перенос в SQLite пачками по BATCH_ROWS строк, повторы отсекает первичный ключ ---
+def import_json(storage, path=DATA_FILE, chunk_size=CHUNK_SIZE):
+    rows, total = [], 0
+    for user, dates in iter_json_marks(path, chunk_size):
+        rows.extend((user, parse_day(d).toordinal()) for d in dates)
+        if len(rows) >= BATCH_ROWS:
+            total += storage.insert_marks(rows)
+            rows = []
+    if rows:
+        total += storage.insert_marks(rows)
+    return total
+
+
+# --- обратно в data.json формата "users", по пользователю за раз ---
+def dump_json(storage, path=DATA_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for i, (user, ordinals) in enumerate(storage.iter_marks()):
+            dates = [date.fromordinal(d).isoformat() for d in ordinals]
+            f.write(("," if i else "") + json.dumps(user, ensure_ascii=False) + ":" + json.dumps(dates))
+        f.write("}")
+    os.replace(tmp_path, path)
+
+
+# --- CSV с историей пользователя: дата и день недели ---
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+
+def write_csv(dates, out):
+    writer = csv.writer(out)
+    writer.writerow(["date", "weekday"])
+    for day in dates:
+        writer.writerow([day.isoformat(), WEEKDAYS[day.weekday()]])
+
+
+# для reply_document: байты CSV в UTF-8 с BOM, чтобы Excel не путал кириллицу
+def csv_document(dates):
+    text = io.StringIO()
+    write_csv(dates, text)
+    return io.BytesIO(text.getvalue().encode("utf-8-sig"))
+
+
+def main():
+    from storage import SqliteStorage
+
+    args = sys.argv[1:]
+    command = args.pop(0) if args else ""
+    if command == "import":
+        json_path = args[0] if args else DATA_FILE
+        storage = SqliteStorage(args[1] if len(args) > 1 else DB_FILE)
+        print(f"{json_path}: формат {detect_file_layout(json_path)!r}")
+        print(f"Перенесено отметок: {import_json(storage, json_path)}")
+        storage.set_meta("migrated_from", os.path.abspath(json_path))
+        storage.close()
+    elif command == "dump":
+        storage = SqliteStorage(args[0] if args else DB_FILE)
+        dump_json(storage, args[1] if len(args) > 1 else DATA_FILE)
+        storage.close()
+    elif command == "export" and args:
+        storage = SqliteStorage(args[1] if len(args) > 1 else DB_FILE)
+        out_path = args[2] if len(args) > 2 else f"{args[0]}.csv"
+        with open(out_path, "w", encoding="utf-8-sig", newline="") as out:
+            write_csv(storage.get_dates(args[0]), out)
+        storage.close()
+    else:
+        print("Использование: python datafile.py import|dump|export ...")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+# --- индекс отметок в памяти ---
+# Для каждого пользователя — отсортированный список дней (date.toordinal()),
+# подсчёт за период — два бинарных поиска, от длины истории не зависит.
+class DateIndex:
+    def __init__(self):
+        self.days = {}
+
+    def __contains__(self, user):
+        return user in self.days
+
+    def users(self):
+        return list(self.days)
+
+    def load(self, user, ordinals):
+        self.days[user] = sorted(set(ordinals))
+
+    def add(self, user, day):
+        ordinal = day.toordinal()
+        days = self.days.setdefault(user, [])
+        i = bisect_left(days, ordinal)
+        if i < len(days) and days[i] == ordinal:
+            return False
+        days.insert(i, ordinal)
+        return True
+
+    def has(self, user, day):
+        days = self.days.get(user, ())
+        i = bisect_left(days, day.toordinal())
+        return i < len(days) and days[i] == day.toordinal()
+
+    def remove_user(self, user):
+        self.days.pop(user, None)
+
+    def count(self, user, start, end):
+        days = self.days.get(user)
+        if not days:
+            return 0
+        return bisect_right(days, end.toordinal()) - bisect_left(days, start.toordinal())
+
+    def total(self, user):
+        return len(self.days.get(user, ()))
+
+    def ordinals(self, user):
+        return self.days.get(user, [])
+
+    def dates(self, user):
+        return [date.fromordinal(d) for d in self.days.get(user, ())]
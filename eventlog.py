@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+import metrics
+from groupcommit import COMMIT_WINDOW, GroupCommit
+from rollups import RollupCache
+from storage import Storage, DATA_FILE, parse_day, rollback, detect_layout, from_layout, to_layout, new_index
+
+# --- файловое хранилище: снимок data.json + журнал событий ---
+# Каждое изменение дописывается строкой в data.json.log:
+#   ["m", user, "YYYY-MM-DD"] — отметка, ["r", user] — обнуление.
+# Записи копятся COMMIT_WINDOW секунд и уходят на диск одним fsync (GroupCommit);
+# ошибка записи достаётся всем, кто ждал этой пачки, поток записи при этом не умирает.
+# Фоновый поток раз в COMPACT_INTERVAL секунд сворачивает журнал в новый снимок:
+# журнал переименовывается в .old, снимок пишется во временный файл и
+# атомарно подменяет data.json через os.replace, после чего .old удаляется.
+# Строка журнала не должна склеиться с оборванной: при восстановлении хвост без "\n"
+# отрезается, а пачка, которую не удалось записать, — обрезается до прежнего размера файла.
+COMPACT_INTERVAL = 60
+COMPACT_MIN_EVENTS = 1000
+
+
+# отрезает оборванную последнюю строку (без "\n"); True — было что отрезать
+def truncate_torn_tail(path):
+    with open(path, "rb+") as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                pos += newline + 1 - step
+                break
+            pos -= step
+        if pos == end:
+            return False
+        f.truncate(pos)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+# один os.write может записать не всё
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+class EventLogStorage(Storage):
+    def __init__(self, path=DATA_FILE, layout="users", commit_window=COMMIT_WINDOW,
+                 compact_interval=COMPACT_INTERVAL, compact_min_events=COMPACT_MIN_EVENTS):
+        self.path = path
+        self.log_path = path + ".log"
+        self.old_log_path = path + ".log.old"
+        self.layout = layout
+        self.commit_window = commit_window
+        self.compact_interval = compact_interval
+        self.compact_min_events = compact_min_events
+
+        self.lock = threading.Lock()  # состояние в памяти
+        self.io_lock = threading.Lock()  # файл журнала
+        self.closing = threading.Event()
+        self.log_events = 0
+
+        self.index = new_index()
+        self.rollups = RollupCache()
+        self._recover()
+        self.log_file = open(self.log_path, "ab", buffering=0)
+
+        self.commits = GroupCommit(self._write_lines, window=commit_window, name="eventlog-commit")
+        self.compactor = threading.Thread(target=self._compact_loop, name="eventlog-compact", daemon=True)
+        self.compactor.start()
+
+    # --- восстановление: снимок, затем незавершённая ротация, затем журнал ---
+    def _recover(self):
+        started = time.perf_counter()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                try:
+                    raw = json.load(f)
+                except json.JSONDecodeError:
+                    raw = None
+            if raw is None:
+                corrupt_path = self.path + ".corrupt"
+                os.replace(self.path, corrupt_path)
+                print(f"⚠ {self.path} повреждён, сохранён как {corrupt_path}, продолжаю по журналу")
+            else:
+                if raw and detect_layout(raw) != self.layout:
+                    # не теряем чужие записи: снимок остаётся в формате файла
+                    self.layout = detect_layout(raw)
+                    print(f"⚠ {self.path} в формате {self.layout!r}, сохраняю его")
+                self._load(from_layout(raw))
+        for path in (self.old_log_path, self.log_path):
+            self.log_events += self._replay(path)
+        if metrics.ENABLED:
+            size = sum(os.path.getsize(p) for p in (self.path, self.old_log_path, self.log_path) if os.path.exists(p))
+            metrics.storage_io("load", started, size)
+
+    def _replay(self, path):
+        if not os.path.exists(path):
+            return 0
+        if truncate_torn_tail(path):
+            # событие из оборванной строки не было подтверждено
+            print(f"⚠ Отрезана неполная запись в конце {path}")
+        count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"⚠ Пропускаю повреждённую запись в {path}")
+                    continue
+                self._apply(event)
+                count += 1
+        return count
+
+    def _apply(self, event):
+        if event[0] == "m":
+            day = parse_day(event[2])
+            if self.index.add(event[1], day):
+                self.rollups.added(event[1], day.toordinal())
+        elif event[0] == "r":
+            self.index.remove_user(event[1])
+            self.rollups.invalidate(event[1])
+
+    # --- запись события: меняем память сразу, ждём fsync своей пачки ---
+    # вызывается под self.lock: порядок строк в журнале совпадает с порядком изменений в памяти
+    # пачка, которая не записалась, откатывает свои изменения в памяти (storage.rollback)
+    def _append(self, event):
+        if event[0] == "m":
+            undo = ("m", event[1], parse_day(event[2]).toordinal())
+        else:
+            undo = ("r", event[1], list(self._ordinals(event[1])))
+        self._apply(event)
+        return self.commits.stage((json.dumps(event, ensure_ascii=False) + "\n", undo))
+
+    # вызывается под self.lock; вся история пользователя
+    def _ordinals(self, user):
+        return list(self.index.ordinals(user))
+
+    # items — (строка журнала, undo)
+    def _write_lines(self, items):
+        data = "".join(line for line, _ in items).encode("utf-8")
+        with self.io_lock:
+            started = time.perf_counter()
+            fd = self.log_file.fileno()
+            size = os.fstat(fd).st_size
+            try:
+                write_all(fd, data)
+                os.fsync(fd)
+            except OSError:
+                # недописанная пачка не подтверждена: убираем её, чтобы следующая легла с новой строки
+                try:
+                    os.ftruncate(fd, size)
+                except OSError as e:
+                    print(f"⚠ Не удалось обрезать журнал после ошибки записи: {e}")
+                with self.lock:
+                    rollback(self.index, self.rollups, [undo for _, undo in items])
+                raise
+            metrics.storage_io("log_write", started, len(data))
+            with self.lock:
+                self.log_events += len(items)
+
+    # --- компактизация ---
+    def _compact_loop(self):
+        while True:
+            if self.closing.wait(self.compact_interval):
+                return
+            with self.lock:
+                due = self.log_events >= self.compact_min_events
+            if due:
+                try:
+                    self.compact()
+                except OSError as e:
+                    print(f"⚠ Не удалось свернуть журнал: {e}")
+
+    def compact(self):
+        with self.io_lock:
+            with self.lock:
+                snapshot = self._dump()
+                self.log_events = 0
+            self._rotate_log()
+        tmp_path = self.path + ".tmp"
+        started = time.perf_counter()
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(to_layout(snapshot, self.layout), f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, self.path)
+        self._fsync_dir()
+        metrics.storage_io("snapshot_write", started, size)
+        os.remove(self.old_log_path)
+
+    # вызывается под self.io_lock
+    def _rotate_log(self):
+        # незаписанные события попадут в новый журнал; повторное применение
+        # поверх снимка, который их уже содержит, ничего не меняет
+        self.log_file.close()
+        if os.path.exists(self.old_log_path):
+            # прошлая компактизация не дошла до конца: дописываем старый журнал к новому
+            with open(self.old_log_path, "a", encoding="utf-8") as old, \
+                    open(self.log_path, "r", encoding="utf-8") as cur:
+                old.writelines(cur)
+        else:
+            os.replace(self.log_path, self.old_log_path)
+        self.log_file = open(self.log_path, "wb", buffering=0)
+
+    def _fsync_dir(self):
+        if os.name != "posix":
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _load(self, data):
+        self.index = new_index()
+        self.rollups.clear()
+        for user, dates in data.items():
+            self.index.load(user, (parse_day(d).toordinal() for d in dates))
+
+    def _dump(self):
+        return {user: [d.isoformat() for d in self.index.dates(user)] for user in self.index.users()}
+
+    # вызывается под self.lock перед чтением истории пользователя; здесь вся история
+    # уже в памяти, MmapStorage поднимает пользователя из снимка по требованию
+    def _ensure_loaded(self, user):
+        pass
+
+    # --- интерфейс Storage ---
+    def load_data(self):
+        with self.lock:
+            return self._dump()
+
+    def save_data(self, data):
+        with self.lock:
+            self._load(data)
+        self.compact()
+
+    def users(self):
+        with self.lock:
+            return self.index.users()
+
+    def users_marked_on(self, day):
+        with self.lock:
+            return [user for user in self.index.users() if self.index.has(user, day)]
+
+    def iter_marks(self, users=None):
+        with self.lock:
+            users = self.index.users() if users is None else list(users)
+            return [(user, list(self.index.ordinals(user))) for user in users]
+
+    def get_dates(self, user):
+        with self.lock:
+            self._ensure_loaded(user)
+            return self.index.dates(user)
+
+    # stage_* — как в SqliteStorage: номер записи в commits или None, если менять нечего
+    def stage_today(self, user, day=None):
+        day = day or datetime.now().date()
+        with self.lock:
+            self._ensure_loaded(user)
+            if self.index.has(user, day):
+                return None
+            return self._append(["m", user, day.isoformat()])
+
+    def record_today(self, user, day=None):
+        seq = self.stage_today(user, day)
+        if seq is None:
+            return False
+        self.commits.wait(seq)
+        return True
+
+    def count_range(self, user, start, end):
+        with self.lock:
+            self._ensure_loaded(user)
+            return self.index.count(user, start, end)
+
+    def count_total(self, user):
+        with self.lock:
+            self._ensure_loaded(user)
+            return self.index.total(user)
+
+    def summary(self, user, today=None):
+        today = today or datetime.now().date()
+        with self.lock:
+            self._ensure_loaded(user)
+            rollup = self.rollups.get(user, lambda: self.index.ordinals(user), today.toordinal())
+        return rollup.summary(today)
+
+    def stage_reset(self, user):
+        with self.lock:
+            self._ensure_loaded(user)
+            if not self.index.total(user):
+                return None
+            return self._append(["r", user])
+
+    def reset(self, user):
+        seq = self.stage_reset(user)
+        if seq is not None:
+            self.commits.wait(seq)
+
+    def close(self):
+        self.commits.close()
+        self.closing.set()
+        self.compactor.join()
+        self.compact()
+        self.log_file.close()
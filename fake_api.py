@@ -0,0 +1,142 @@
+import sys
+import json
+import time
+import random
+import asyncio
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+# --- локальная заглушка Bot API для нагрузочных тестов ---
+# Понимает getUpdates (long polling), sendMessage, sendDocument, editMessageText и answerCallbackQuery,
+# на остальные методы отвечает true. latency — задержка каждого ответа в секундах,
+# throttle — доля sendMessage/editMessageText, на которые вернётся 429 с retry_after.
+# Бот направляется сюда через TELEGRAM_API_URL (см. webhook.app_builder).
+# Отдельный запуск: python fake_api.py [порт] [задержка, мс] [доля 429]
+REPLY_METHODS = {"sendMessage", "sendDocument", "editMessageText", "answerCallbackQuery"}
+THROTTLED_METHODS = {"sendMessage", "editMessageText"}
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, throttle=0.0, retry_after=1, seed=1, track_replies=True):
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_updates = asyncio.Event()
+        self.calls = Counter()
+        self.throttled = 0
+        # chat_id -> очередь (метод, текст, время ответа) — по ней клиенты ждут ответы бота
+        self.replies = defaultdict(asyncio.Queue)
+        self.track_replies = track_replies
+
+    # --- обновления от «пользователей» ---
+    def _push(self, update):
+        update["update_id"] = self.next_update_id
+        self.next_update_id += 1
+        self.updates.append(update)
+        self.new_updates.set()
+        return update
+
+    def push_message(self, chat_id, text):
+        message = {
+            "message_id": self._message_id(), "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._push({"message": message})
+
+    def push_callback(self, chat_id, data):
+        message = {
+            "message_id": self._message_id(), "date": int(time.time()), "text": "💊",
+            "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER,
+        }
+        return self._push({"callback_query": {
+            "id": f"{chat_id}:{self.next_update_id}", "data": data, "chat_instance": str(chat_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "message": message,
+        }})
+
+    def _message_id(self):
+        self.next_message_id += 1
+        return self.next_message_id
+
+    # --- методы API ---
+    async def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self.updates[:limit]
+
+    def reply(self, method, params):
+        if method == "answerCallbackQuery":
+            chat_id = int(str(params["callback_query_id"]).split(":")[0])
+            result = True
+        else:
+            chat_id = int(params["chat_id"])
+            result = {
+                "message_id": int(params.get("message_id") or self._message_id()), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, "text": params.get("text", ""),
+            }
+        if self.track_replies:
+            self.replies[chat_id].put_nowait((method, params.get("text"), time.perf_counter()))
+        return result
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return ok(await self.get_updates(params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method in THROTTLED_METHODS and self.throttle and self.rng.random() < self.throttle:
+            self.throttled += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        if method == "getMe":
+            return ok(BOT_USER)
+        if method in REPLY_METHODS:
+            return ok(self.reply(method, params))
+        return ok(True)
+
+    def web_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+def ok(result):
+    return web.json_response({"ok": True, "result": result}, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    throttle = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    api = FakeBotAPI(latency, throttle, track_replies=False)
+    print(f"Заглушка Bot API: TELEGRAM_API_URL=http://127.0.0.1:{port}")
+    web.run_app(api.web_app(), host="127.0.0.1", port=port, print=None)
+
+
+if __name__ == "__main__":
+    main()
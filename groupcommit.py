@@ -0,0 +1,109 @@
+import os
+import asyncio
+import threading
+import time
+
+# --- групповая запись: изменения копятся и уходят на диск одной записью ---
+# Обработчик ставит изменение в очередь (stage), меняет состояние в памяти и ждёт,
+# пока его пачка станет надёжной (wait — из потока, durable — из цикла событий),
+# и только потом отвечает. Фоновый поток раз в window секунд забирает всё накопленное
+# и вызывает write(items) — одна транзакция или один fsync на пачку, сколько бы
+# обновлений ни пришло за окно. Так число записей на диск в секунду держится
+# около 1/window и не растёт вместе с потоком обновлений.
+# COMMIT_WINDOW — окно в секундах, общее для хранилища и настроек.
+COMMIT_WINDOW = float(os.environ.get("COMMIT_WINDOW", "0.01"))
+
+
+class GroupCommit:
+    def __init__(self, write, window=COMMIT_WINDOW, name="group-commit"):
+        self.write = write
+        self.window = window
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()  # пачки пишутся строго по очереди
+        self.changed = threading.Condition(self.lock)
+        self.pending = []
+        self.staged_seq = 0  # номер последнего изменения в очереди
+        self.synced_seq = 0  # номер последнего изменения на диске
+        self.waiters = []  # (seq, loop, future) для durable()
+        self.failed = None  # (первый, последний номер, исключение) неудачной пачки
+        self.closed = False
+        self.writes = 0
+        self.thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self.thread.start()
+
+    def stage(self, item):
+        with self.lock:
+            self.pending.append(item)
+            self.staged_seq += 1
+            self.changed.notify_all()
+            return self.staged_seq
+
+    def wait(self, seq):
+        with self.lock:
+            while self.synced_seq < seq and not self.closed:
+                self.changed.wait()
+            self._check(seq)
+
+    async def durable(self, seq):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.synced_seq >= seq or self.closed:
+                self._check(seq)
+                return
+            self.waiters.append((seq, loop, future))
+        await future
+
+    # вызывается под self.lock; ошибка записи достаётся всем, кто ждал этой пачки
+    def _check(self, seq):
+        if self.failed is not None and self.failed[0] <= seq <= self.failed[1]:
+            raise self.failed[2]
+
+    def _loop(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.changed.wait()
+                if self.closed and not self.pending:
+                    return
+            time.sleep(self.window)
+            self.flush()
+
+    def flush(self):
+        with self.io_lock:
+            with self.lock:
+                items, self.pending = self.pending, []
+                seq = self.staged_seq
+            error = None
+            if items:
+                try:
+                    self.write(items)
+                    self.writes += 1
+                except Exception as e:
+                    print(f"⚠ Групповая запись не удалась: {e}")
+                    error = e
+            with self.lock:
+                if error is not None:
+                    self.failed = (seq - len(items) + 1, seq, error)
+                self.synced_seq = seq
+                self.changed.notify_all()
+                ready = [w for w in self.waiters if w[0] <= seq]
+                self.waiters = [w for w in self.waiters if w[0] > seq]
+        for _, loop, future in ready:
+            loop.call_soon_threadsafe(_resolve, future, error)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.changed.notify_all()
+        self.thread.join()
+        self.flush()
+
+
+def _resolve(future, error):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
@@ -0,0 +1,190 @@
+import os
+import time
+import functools
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+# --- метрики в текстовом формате Prometheus ---
+# Включаются переменной METRICS_PORT: тогда на этом порту поднимается GET /metrics.
+# Без неё ENABLED = False, timed() и daily_job() возвращают функцию как есть,
+# остальные функции записи сразу выходят — в горячем пути остаётся одна проверка флага.
+# Счётчики живут в памяти процесса; в многопроцессном режиме у каждого воркера свой порт
+# (METRICS_PORT + номер шарда).
+METRICS_PORT = os.environ.get("METRICS_PORT")
+ENABLED = bool(METRICS_PORT)
+PREFIX = "pillbot_"
+
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_lock = threading.Lock()  # хранилища пишут метрики из своих потоков
+_registry = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.label_names = labels
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=FAST_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [счётчики по корзинам..., +Inf, сумма]
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        with _lock:
+            row = self.values.get(labels)
+            if row is None:
+                row = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, row in sorted(self.values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row):
+                total += count
+                le = _labels(self.label_names + ("le",), labels + (bound,))
+                lines.append(f"{self.name}_bucket{le} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {row[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {total}")
+        return lines
+
+
+HANDLER_SECONDS = Histogram("handler_seconds", "Время обработчика обновления", ("handler",))
+HANDLER_ERRORS = Counter("handler_errors_total", "Исключения в обработчиках", ("handler",))
+STORAGE_CALL_SECONDS = Histogram("storage_call_seconds", "Вызов хранилища из обработчика, с ожиданием потока", ("method",))
+STORAGE_IO_SECONDS = Histogram("storage_io_seconds", "Чтение и запись файлов данных", ("op",))
+STORAGE_IO_BYTES = Counter("storage_io_bytes_total", "Байт прочитано и записано в файлы данных", ("op",))
+JOB_LAG_SECONDS = Histogram("job_lag_seconds", "Опоздание запуска ежедневной задачи", ("job",), buckets=LAG_BUCKETS)
+SENDS = Counter("sends_total", "Отправки рассылок по исходу", ("job", "result"))
+ADMISSION_DROPS = Counter("admission_dropped_total", "Входящие обновления, отброшенные до обработчиков", ("reason",))
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- точки записи ---
+def timed(callback):
+    if not ENABLED:
+        return callback
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def storage_io(op, started, size):
+    if ENABLED:
+        STORAGE_IO_SECONDS.observe(time.perf_counter() - started, op)
+        STORAGE_IO_BYTES.inc(op, amount=size)
+
+
+def send_result(job, result):
+    if ENABLED:
+        SENDS.inc(job, result)
+
+
+def admission_dropped(reason):
+    if ENABLED:
+        ADMISSION_DROPS.inc(reason)
+
+
+# опоздание относительно ежедневного запуска в at_minute (минута суток UTC)
+def job_lag(job, at_minute):
+    if ENABLED:
+        now = datetime.now(timezone.utc)
+        seconds = now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1e6
+        JOB_LAG_SECONDS.observe((seconds - at_minute * 60) % 86400, job)
+
+
+# обёртка для job_queue.run_daily(callback, at): at — datetime.time без пояса (UTC, как в PTB) или с поясом
+def daily_job(callback, at):
+    if not ENABLED:
+        return callback
+    utc = datetime.combine(datetime.now(timezone.utc).date(), at)
+    if at.tzinfo is not None:
+        utc = utc.astimezone(timezone.utc)
+    at_minute = utc.hour * 60 + utc.minute
+
+    @functools.wraps(callback)
+    async def wrapper(context):
+        job_lag(callback.__name__, at_minute)
+        await callback(context)
+    return wrapper
+
+
+# --- HTTP: GET /metrics ---
+# install(app) добавляет запуск сервера в post_init и остановку в post_shutdown приложения
+def install(app, port_offset=0):
+    if not ENABLED:
+        return
+    post_init, post_shutdown = app.post_init, app.post_shutdown
+
+    async def start(app):
+        app.bot_data["metrics_runner"] = await serve(int(METRICS_PORT) + port_offset)
+        if post_init:
+            await post_init(app)
+
+    async def stop(app):
+        if post_shutdown:
+            await post_shutdown(app)
+        await app.bot_data["metrics_runner"].cleanup()
+
+    app.post_init = start
+    app.post_shutdown = stop
+
+
+async def serve(port, host="0.0.0.0"):
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,279 @@
+import os
+import json
+import mmap
+import time
+import struct
+from datetime import date
+
+import metrics
+from eventlog import EventLogStorage
+from storage import DATA_FILE, parse_day
+
+# --- снимок data.json с индексом смещений: холодный старт без разбора всего файла ---
+# Рядом с data.json лежит data.json.idx: для каждого пользователя — где в data.json
+# начинается и сколько байт занимает его список дат. Оба файла открываются через mmap,
+# записи индекса отсортированы по ключу, пользователь ищется двоичным поиском прямо
+# в отображении — при открытии ничего не читается, время старта не зависит от числа
+# пользователей. Декодируется только история того, кто прислал запрос.
+# data.json остаётся обычным JSON формата "users": его читают datafile.py и STORAGE=json.
+# В заголовке индекса — размер и mtime data.json; если файл поменяли в обход (или индекса
+# нет), индекс один раз перестраивается потоковым разбором data.json.
+# Формат .idx: MAGIC, HEADER (число записей, размер и mtime_ns data.json),
+# таблица смещений записей (u64), записи: длина ключа (u16), ключ UTF-8, смещение (u64) и длина (u32) списка.
+MAGIC = b"PILLIDX1"
+HEADER = struct.Struct("<QQq")
+SLOT = struct.Struct("<Q")
+KEY_LEN = struct.Struct("<H")
+SPAN = struct.Struct("<QI")
+
+
+class StaleIndex(Exception):
+    pass
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        if not os.path.exists(self.index_path):
+            raise StaleIndex(self.index_path)
+        stat = os.stat(path)
+        with open(self.index_path, "rb") as f:
+            self.idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.idx[:len(MAGIC)] != MAGIC:
+            self.idx.close()
+            raise StaleIndex(self.index_path)
+        self.count, size, mtime_ns = HEADER.unpack_from(self.idx, len(MAGIC))
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            self.idx.close()
+            raise StaleIndex(self.index_path)
+        self.table = len(MAGIC) + HEADER.size
+        self.data = None
+        if size:
+            with open(path, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, i):
+        (pos,) = SLOT.unpack_from(self.idx, self.table + i * SLOT.size)
+        (length,) = KEY_LEN.unpack_from(self.idx, pos)
+        start = pos + KEY_LEN.size
+        return self.idx[start:start + length], start + length
+
+    def _find(self, user):
+        key = user.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found, pos = self._key(mid)
+            if found == key:
+                return SPAN.unpack_from(self.idx, pos)
+            if found < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    # список дат пользователя как есть, байтами JSON; None — такого нет
+    def raw(self, user):
+        span = self._find(user)
+        if span is None:
+            return None
+        offset, length = span
+        return self.data[offset:offset + length]
+
+    def ordinals(self, user):
+        raw = self.raw(user)
+        return [parse_day(d).toordinal() for d in json.loads(raw)] if raw else []
+
+    def users(self):
+        for i in range(self.count):
+            yield self._key(i)[0].decode("utf-8")
+
+    def close(self):
+        self.idx.close()
+        if self.data is not None:
+            self.data.close()
+
+
+# items — (user, список дат байтами JSON); пишет data.json и data.json.idx через временные файлы
+def write_snapshot(path, items):
+    tmp_path, index_tmp_path = path + ".tmp", path + ".idx.tmp"
+    entries = []
+    with open(tmp_path, "wb") as f:
+        f.write(b"{")
+        for user, raw in items:
+            f.write((b"," if entries else b"") + json.dumps(user, ensure_ascii=False).encode("utf-8") + b":")
+            entries.append((user.encode("utf-8"), f.tell(), len(raw)))
+            f.write(raw)
+        f.write(b"}")
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    stat = os.stat(path)
+
+    entries.sort()
+    table = len(MAGIC) + HEADER.size
+    pos = table + SLOT.size * len(entries)
+    slots, records = [], []
+    for key, offset, length in entries:
+        slots.append(SLOT.pack(pos))
+        record = KEY_LEN.pack(len(key)) + key + SPAN.pack(offset, length)
+        records.append(record)
+        pos += len(record)
+    with open(index_tmp_path, "wb") as f:
+        f.write(MAGIC + HEADER.pack(len(entries), stat.st_size, stat.st_mtime_ns))
+        f.writelines(slots)
+        f.writelines(records)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(index_tmp_path, path + ".idx")
+    return size
+
+
+def dates_json(dates):
+    return json.dumps(dates).encode("utf-8")
+
+
+# индекса нет или он устарел: один проход по data.json, даты приводятся к ISO
+def rebuild_snapshot(path):
+    from datafile import iter_json_items
+
+    def items():
+        for user, dates in iter_json_items(path):
+            if not isinstance(dates, list):
+                raise ValueError(f"{path} в плоском формате, STORAGE=mmap работает только с форматом users")
+            days = sorted({parse_day(d) for d in dates})
+            if days:
+                yield user, dates_json([d.isoformat() for d in days])
+    write_snapshot(path, items())
+
+
+def open_snapshot(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except StaleIndex:
+        pass
+    started = time.perf_counter()
+    try:
+        rebuild_snapshot(path)
+    except json.JSONDecodeError:
+        corrupt_path = path + ".corrupt"
+        os.replace(path, corrupt_path)
+        print(f"⚠ {path} повреждён, сохранён как {corrupt_path}, продолжаю по журналу")
+        return None
+    snapshot = Snapshot(path)
+    print(f"Индекс {snapshot.index_path}: {len(snapshot)} пользователей за {time.perf_counter() - started:.2f} с")
+    return snapshot
+
+
+# --- журнал событий поверх снимка с индексом (STORAGE=mmap) ---
+# Запись — как в EventLogStorage: событие в журнал, group commit, компактизация.
+# В памяти (DateIndex) — только те, кто обращался с момента запуска; остальные
+# читаются из снимка. Компактизация не поднимает снимок целиком: списки незатронутых
+# пользователей копируются байтами из старого снимка в новый.
+class MmapStorage(EventLogStorage):
+    def __init__(self, path=DATA_FILE, **kwargs):
+        self.snapshot = None
+        super().__init__(path, layout="users", **kwargs)
+
+    def _recover(self):
+        started = time.perf_counter()
+        self.snapshot = open_snapshot(self.path)
+        for path in (self.old_log_path, self.log_path):
+            self.log_events += self._replay(path)
+        if metrics.ENABLED:
+            size = sum(os.path.getsize(p) for p in (self.old_log_path, self.log_path) if os.path.exists(p))
+            metrics.storage_io("load", started, size)
+
+    # вызывается под self.lock
+    def _ensure_loaded(self, user):
+        if user not in self.index:
+            self.index.load(user, self.snapshot.ordinals(user) if self.snapshot else ())
+
+    # вызывается под self.lock; история без кэширования в индексе — для проходов по всем
+    def _ordinals(self, user):
+        if user in self.index or self.snapshot is None:
+            return list(self.index.ordinals(user))
+        return self.snapshot.ordinals(user)
+
+    def _apply(self, event):
+        self._ensure_loaded(event[1])
+        if event[0] == "r":
+            # пустая история в памяти закрывает пользователя из снимка
+            self.index.load(event[1], ())
+            self.rollups.invalidate(event[1])
+        else:
+            super()._apply(event)
+
+    # save_data: новые данные целиком заменяют снимок
+    def _load(self, data):
+        super()._load(data)
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    # вызывается под self.lock
+    def _users(self):
+        users = [user for user in self.index.users() if self.index.total(user)]
+        if self.snapshot is not None:
+            users.extend(user for user in self.snapshot.users() if user not in self.index)
+        return users
+
+    def _dump(self):
+        return {user: [date.fromordinal(d).isoformat() for d in self._ordinals(user)] for user in self._users()}
+
+    def users(self):
+        with self.lock:
+            return self._users()
+
+    # незагруженных проверяем поиском даты в байтах снимка, без разбора JSON
+    def users_marked_on(self, day):
+        needle = json.dumps(day.isoformat()).encode("utf-8")
+        with self.lock:
+            result = [user for user in self.index.users() if self.index.has(user, day)]
+            if self.snapshot is not None:
+                result.extend(user for user in self.snapshot.users()
+                              if user not in self.index and needle in self.snapshot.raw(user))
+        return result
+
+    def iter_marks(self, users=None):
+        with self.lock:
+            users = self._users() if users is None else list(users)
+        for user in users:
+            with self.lock:
+                ordinals = self._ordinals(user)
+            yield user, ordinals
+
+    def compact(self):
+        with self.io_lock:
+            with self.lock:
+                loaded = {user: [d.isoformat() for d in self.index.dates(user)] for user in self.index.users()}
+                old = self.snapshot
+                self.log_events = 0
+            self._rotate_log()
+
+        def items():
+            for user, dates in loaded.items():
+                if dates:
+                    yield user, dates_json(dates)
+            if old is not None:
+                for user in old.users():
+                    if user not in loaded:
+                        yield user, old.raw(user)
+
+        started = time.perf_counter()
+        size = write_snapshot(self.path, items())
+        snapshot = Snapshot(self.path)
+        with self.lock:
+            self.snapshot = snapshot
+        if old is not None:
+            old.close()
+        self._fsync_dir()
+        metrics.storage_io("snapshot_write", started, size)
+        os.remove(self.old_log_path)
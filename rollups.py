@@ -0,0 +1,112 @@
+from datetime import date
+
+# --- сводка по пользователю, которая обновляется при записи ---
+# Серии, последняя отметка и окно последних WINDOW дней битами (бит 0 — день last).
+# Новая отметка позже last — сдвиг и OR, O(1); счёт за N дней — popcount по окну,
+# тоже O(1), от длины истории не зависит. Отметка задним числом (раньше last)
+# серии так не пересчитать — тогда сводка выбрасывается и строится заново при чтении.
+WINDOW = 90
+MASK = (1 << WINDOW) - 1
+
+
+class Rollup:
+    __slots__ = ("first", "last", "current", "longest", "bits", "total")
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.current = 0  # серия, заканчивающаяся днём last
+        self.longest = 0
+        self.bits = 0
+        self.total = 0
+
+    @classmethod
+    def build(cls, ordinals):
+        rollup = cls()
+        for ordinal in sorted(ordinals):
+            rollup.add(ordinal)
+        return rollup
+
+    # False — отметка раньше last, сводку нужно построить заново
+    def add(self, ordinal):
+        if self.last is None:
+            self.first = ordinal
+            shift = WINDOW
+        elif ordinal > self.last:
+            shift = ordinal - self.last
+        else:
+            return ordinal == self.last
+        self.bits = ((self.bits << shift) | 1) & MASK if shift < WINDOW else 1
+        self.current = self.current + 1 if shift == 1 else 1
+        self.longest = max(self.longest, self.current)
+        self.last = ordinal
+        self.total += 1
+        return True
+
+    # отметок за days дней, заканчивая today включительно (days <= WINDOW);
+    # при today раньше last в окне остаются только WINDOW - (last - today) дней —
+    # точный счёт тогда даёт сводка, построенная заново (RollupCache.get с today)
+    def count(self, today, days):
+        if self.last is None:
+            return 0
+        shift = today - self.last
+        if shift >= days:
+            return 0
+        if shift < 0:
+            days = min(days, WINDOW + shift)
+            if days <= 0:
+                return 0
+        window = self.bits << shift if shift >= 0 else self.bits >> -shift
+        return (window & ((1 << days) - 1)).bit_count()
+
+    # серия жива, если отмечено сегодня или вчера
+    def streak(self, today):
+        return self.current if self.last is not None and today - self.last <= 1 else 0
+
+    # доля дней с отметкой из последних days, но не раньше первой отметки
+    def adherence(self, today, days):
+        if self.first is None:
+            return 0
+        span = min(days, today - self.first + 1)
+        return round(self.count(today, days) * 100 / span) if span > 0 else 0
+
+    def summary(self, day):
+        today = day.toordinal()
+        return {
+            "week": self.count(today, 7),
+            "month": self.count(today, day.day),
+            "streak": self.streak(today),
+            "longest": self.longest,
+            "last": date.fromordinal(self.last) if self.last is not None else None,
+            "adherence30": self.adherence(today, 30),
+            "adherence90": self.adherence(today, 90),
+            "total": self.total,
+        }
+
+
+# сводки пользователей в памяти хранилища; все методы — под блокировкой хранилища
+class RollupCache:
+    def __init__(self):
+        self.rollups = {}
+
+    # ordinals() вызывается только при промахе — или если today (ordinal) раньше last:
+    # часть окна до today из сводки уже выпала, и сводка на today строится заново
+    # по истории до today, не попадая в кэш
+    def get(self, user, ordinals, today=None):
+        rollup = self.rollups.get(user)
+        if rollup is None:
+            rollup = self.rollups[user] = Rollup.build(ordinals())
+        if today is not None and rollup.last is not None and rollup.last > today:
+            return Rollup.build(o for o in ordinals() if o <= today)
+        return rollup
+
+    def added(self, user, ordinal):
+        rollup = self.rollups.get(user)
+        if rollup is not None and not rollup.add(ordinal):
+            del self.rollups[user]
+
+    def invalidate(self, user):
+        self.rollups.pop(user, None)
+
+    def clear(self):
+        self.rollups.clear()
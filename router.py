@@ -0,0 +1,34 @@
+from telegram.ext import MessageHandler, filters
+
+from metrics import timed
+
+# --- маршрутизация кнопок по точному тексту ---
+# Вместо цепочки MessageHandler(filters.Regex(...)), где каждое сообщение по очереди
+# проверяется всеми регулярками, — один обработчик и поиск текста в словаре.
+
+
+class ExactText(filters.MessageFilter):
+    # texts — любой контейнер с быстрым `in`: set, frozenset или dict
+    def __init__(self, texts, name=None):
+        self.texts = texts
+        super().__init__(name=name or f"ExactText({len(texts)})")
+
+    def filter(self, message):
+        return message.text in self.texts
+
+
+class TextRouter:
+    def __init__(self, routes=None):
+        self.routes = {}
+        for text, callback in (routes or {}).items():
+            self.add(text, callback)
+
+    def add(self, text, callback):
+        self.routes[text] = timed(callback)
+
+    async def dispatch(self, update, context):
+        # значение callback возвращается как есть — ConversationHandler берёт из него следующее состояние
+        return await self.routes[update.message.text](update, context)
+
+    def handler(self):
+        return MessageHandler(ExactText(self.routes), self.dispatch)
@@ -0,0 +1,117 @@
+import warnings
+from datetime import datetime, time
+
+import pytz
+from telegram.warnings import PTBUserWarning
+
+import metrics
+
+# дни уже переведены в схему cron через ptb_days, напоминание PTB об этом лишнее
+warnings.filterwarnings("ignore", message="Prior to v20.0 the `days`", category=PTBUserWarning)
+
+# --- планировщик напоминаний по слотам ---
+# Пользователи группируются в корзины по ключу (минута суток в UTC, маска дней недели в UTC).
+# На каждую непустую корзину — одна задача job_queue.run_daily, которая отдаёт
+# callback(context, chat_ids) весь список чатов корзины. Перенос времени одного
+# пользователя — перемещение между двумя множествами, без поиска задач по имени.
+ALL_DAYS = 0b1111111  # бит i — день недели i, понедельник = 0, как datetime.weekday()
+
+
+def to_utc_slot(hour, minute, tz, days=ALL_DAYS, today=None):
+    zone = pytz.timezone(tz)
+    today = today or datetime.now(zone).date()
+    local = zone.localize(datetime.combine(today, time(hour, minute)))
+    utc = local.astimezone(pytz.utc)
+    shift = (utc.date() - today).days  # -1, 0 или 1
+    mask = 0
+    for day in range(7):
+        if days & (1 << day):
+            mask |= 1 << ((day + shift) % 7)
+    return utc.hour * 60 + utc.minute, mask
+
+
+def ptb_days(mask):
+    # в python-telegram-bot 20 дни считаются от воскресенья: 0 = Вс, 1 = Пн ...
+    return tuple(sorted((day + 1) % 7 for day in range(7) if mask & (1 << day)))
+
+
+class SlotScheduler:
+    def __init__(self, job_queue, callback, name):
+        self.job_queue = job_queue
+        self.callback = callback
+        self.name = name
+        self.buckets = {}  # (минута UTC, маска) -> set(chat_id)
+        self.jobs = {}  # (минута UTC, маска) -> Job
+        self.user_slot = {}  # chat_id -> (минута UTC, маска)
+        self.user_time = {}  # chat_id -> (hour, minute, tz, days) в местном времени
+
+    def __contains__(self, chat_id):
+        return chat_id in self.user_slot
+
+    def __len__(self):
+        return len(self.user_slot)
+
+    # slots — необязательный кэш {(hour, minute, tz, days): ключ} для массовой загрузки,
+    # чтобы пересчёт часового пояса шёл один раз на набор настроек, а не на пользователя
+    def schedule(self, chat_id, hour, minute, tz="UTC", days=ALL_DAYS, slots=None):
+        params = (hour, minute, tz, days)
+        key = slots.get(params) if slots is not None else None
+        if key is None:
+            key = to_utc_slot(hour, minute, tz, days)
+            if slots is not None:
+                slots[params] = key
+        # только после успешного пересчёта: иначе ежедневный refresh падал бы на этом пользователе
+        self.user_time[chat_id] = params
+        old_key = self.user_slot.get(chat_id)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._leave(chat_id, old_key)
+        self.user_slot[chat_id] = key
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = set()
+            self._start_job(key)
+        bucket.add(chat_id)
+
+    def unschedule(self, chat_id):
+        self.user_time.pop(chat_id, None)
+        key = self.user_slot.pop(chat_id, None)
+        if key is not None:
+            self._leave(chat_id, key)
+
+    def _leave(self, chat_id, key):
+        bucket = self.buckets[key]
+        bucket.discard(chat_id)
+        if not bucket:
+            del self.buckets[key]
+            self.jobs.pop(key).schedule_removal()
+
+    def _start_job(self, key):
+        minute, mask = key
+        self.jobs[key] = self.job_queue.run_daily(
+            self._fire,
+            time=time(minute // 60, minute % 60, tzinfo=pytz.utc),
+            days=ptb_days(mask),
+            data=key,
+            name=f"{self.name}_{minute:04d}_{mask:03d}",
+        )
+
+    async def _fire(self, context):
+        metrics.job_lag(self.name, context.job.data[0])
+        chat_ids = list(self.buckets.get(context.job.data, ()))
+        if chat_ids:
+            await self.callback(context, chat_ids)
+
+    # --- переход на летнее/зимнее время меняет UTC-слот, пересчитываем раз в сутки ---
+    # общий кэш slots: часовой пояс пересчитывается раз на набор настроек, а не на пользователя
+    def refresh(self):
+        slots = {}
+        for chat_id, (hour, minute, tz, days) in list(self.user_time.items()):
+            self.schedule(chat_id, hour, minute, tz, days, slots)
+
+    async def _refresh_job(self, context):
+        self.refresh()
+
+    def start_refresh(self):
+        self.job_queue.run_daily(self._refresh_job, time(0, 1, tzinfo=pytz.utc), name=f"{self.name}_refresh")
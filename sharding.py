@@ -0,0 +1,189 @@
+import os
+import queue
+import signal
+import asyncio
+import multiprocessing
+from types import SimpleNamespace
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut
+
+import webhook
+
+# --- многопроцессный режим: WORKERS=K ---
+# Супервизор получает обновления (polling или вебхук, как обычно через MODE) и
+# раскладывает их по K воркерам: шард = chat_id % K. У каждого воркера своя очередь
+# и свой Application, обновления одного чата всегда идут в один процесс по порядку.
+# Воркер ставит напоминания и отчёты только своим пользователям, поэтому каждый
+# слот рассылки обслуживает ровно один процесс. Отметки лежат в общей базе SQLite,
+# но пишет строки пользователя только воркер его шарда.
+# Упавший воркер супервизор перезапускает с новой очередью: иначе старая заполнится
+# и route() встанет на ней, остановив все шарды, а убитый процесс мог оставить
+# захваченной её блокировку чтения. Обновления, что лежали в старой очереди, теряются.
+QUEUE_SIZE = 1000
+WATCH_INTERVAL = 1  # как часто супервизор проверяет, живы ли воркеры
+RETRY_MAX = 30  # предельная пауза между попытками при ошибках сети, секунд
+
+
+def shard_of(chat_id, count):
+    return chat_id % count
+
+
+def route_key(update):
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return 0
+
+
+# --- воркер ---
+def worker_main(index, count, token, inbox, build_app):
+    # Ctrl+C получает вся группа процессов, останавливает воркеров супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app = build_app(token, shard=(index, count))
+
+    async def serve():
+        while True:
+            raw = await asyncio.to_thread(inbox.get)
+            if raw is None:
+                return
+            await app.update_queue.put(Update.de_json(raw, app.bot))
+
+    asyncio.run(webhook.run_app(app, serve))
+
+
+# --- супервизор ---
+async def route(updates, inboxes):
+    while True:
+        update = await updates.get()
+        if update is None:
+            return
+        shard = shard_of(route_key(update), len(inboxes))
+        raw = update.to_dict()
+        try:
+            inboxes[shard].put_nowait(raw)
+        except queue.Full:
+            # очередь полна: ждём воркера, каждый раз заново беря очередь — её могли заменить при перезапуске
+            while True:
+                try:
+                    await asyncio.to_thread(inboxes[shard].put, raw, True, WATCH_INTERVAL)
+                    break
+                except queue.Full:
+                    pass
+
+
+# ошибки сети переживаем, как Updater в PTB: RetryAfter — ждём, сколько велено,
+# TimedOut — сразу повторяем, прочие NetworkError — пауза от 1 с, растущая до RETRY_MAX.
+# None — остановились раньше, чем вызов удался
+async def retrying(call, stop):
+    delay = 0
+    while not stop.done():
+        request = asyncio.ensure_future(call())
+        await asyncio.wait({request, stop}, return_when=asyncio.FIRST_COMPLETED)
+        if not request.done():
+            request.cancel()
+            return None
+        try:
+            return request.result()
+        except RetryAfter as e:
+            pause = e.retry_after
+        except TimedOut:
+            continue
+        except NetworkError as e:
+            delay = min(RETRY_MAX, delay * 1.5 if delay else 1)
+            pause = delay
+            print(f"⚠ Ошибка сети: {e}, повтор через {pause:.0f} с")
+        await asyncio.wait({stop}, timeout=pause)
+    return None
+
+
+async def poll(bot, updates, until):
+    stop = asyncio.ensure_future(until)
+    await retrying(bot.delete_webhook, stop)
+    offset = None
+    while not stop.done():
+        batch = await retrying(
+            lambda: bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES), stop
+        )
+        for update in batch or ():
+            offset = update.update_id + 1
+            await updates.put(update)
+    # как Updater в PTB: подтверждаем последнюю пачку, иначе после перезапуска она придёт снова
+    if offset is not None:
+        try:
+            await bot.get_updates(offset=offset, timeout=0)
+        except TelegramError as e:
+            print(f"⚠ Не удалось подтвердить полученные обновления: {e}")
+
+
+async def watch(workers, inboxes, start):
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                print(f"⚠ Воркер {worker.name} завершился с кодом {worker.exitcode}, перезапускаю")
+                old = inboxes[i]
+                workers[i] = start(i)
+                # непрочитанное в старой очереди не держит выход супервизора
+                old.cancel_join_thread()
+                old.close()
+
+
+async def stop_worker(worker, inbox):
+    # воркеру, который уже завершился, None не нужен, а его полная очередь заблокировала бы остановку
+    while worker.is_alive():
+        try:
+            await asyncio.to_thread(inbox.put, None, True, WATCH_INTERVAL)
+            break
+        except queue.Full:
+            pass
+    await asyncio.to_thread(worker.join)
+
+
+async def supervise(token, count, build_app):
+    webhook_mode = os.environ.get("MODE", "polling") == "webhook"
+    # до запуска воркеров: без секрета вебхук не поднимается
+    secret = webhook.webhook_secret() if webhook_mode else None
+    ctx = multiprocessing.get_context("spawn")
+    inboxes = [None] * count
+
+    def start(i):
+        inboxes[i] = ctx.Queue(QUEUE_SIZE)
+        worker = ctx.Process(target=worker_main, args=(i, count, token, inboxes[i], build_app), name=f"shard-{i}")
+        worker.start()
+        return worker
+
+    workers = [start(i) for i in range(count)]
+    watcher = asyncio.create_task(watch(workers, inboxes, start))
+    updates = asyncio.Queue()
+    router = asyncio.create_task(route(updates, inboxes))
+    try:
+        async with Bot(token, **webhook.api_urls()) as bot:
+            if webhook_mode:
+                url = os.environ["WEBHOOK_URL"].rstrip("/")
+                path = os.environ.get("WEBHOOK_PATH", "/telegram")
+                await bot.set_webhook(url + path, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+                # make_web_app нужны только update_queue и bot
+                web_app = webhook.make_web_app(
+                    SimpleNamespace(update_queue=updates, bot=bot), path, secret,
+                    int(os.environ.get("WEBHOOK_MAX_QUEUE", "1000"))
+                )
+                await webhook.serve_http(
+                    web_app, os.environ.get("LISTEN", "0.0.0.0"), int(os.environ.get("PORT", "8080")),
+                    webhook.wait_for_signal()
+                )
+            else:
+                await poll(bot, updates, webhook.wait_for_signal())
+    finally:
+        # дорабатываем принятые обновления и останавливаем воркеров, даже если приём упал
+        await updates.put(None)
+        await router
+        watcher.cancel()
+        for worker, inbox in zip(workers, inboxes):
+            await stop_worker(worker, inbox)
+
+
+def run_sharded(token, count, build_app):
+    print(f"Запускаю {count} воркеров")
+    asyncio.run(supervise(token, count, build_app))
@@ -0,0 +1,413 @@
+import os
+import sqlite3
+import asyncio
+import threading
+import time
+from itertools import groupby
+from datetime import date, datetime, timedelta
+
+import metrics
+from dateindex import DateIndex
+from groupcommit import GroupCommit
+from rollups import Rollup, RollupCache
+
+DATA_FILE = "data.json"
+DB_FILE = "data.db"
+DATE_FORMAT = "%Y-%m-%d"
+ITER_PAGE_USERS = 200
+
+
+# ключ пользователя для плоского формата bot_ver2.py: {"YYYY-MM-DD": true}
+FLAT_USER = ""
+
+
+def parse_day(date_str):
+    return date.fromisoformat(date_str)
+
+
+# --- форматы data.json ---
+# "users" (bot.py, bot_ver3.py): {user_id: [dates]}
+# "flat" (bot_ver2.py): {date: true}, без пользователя
+def detect_layout(raw):
+    for value in raw.values():
+        return "users" if isinstance(value, list) else "flat"
+    return "users"
+
+
+def from_layout(raw):
+    if detect_layout(raw) == "flat":
+        return {FLAT_USER: sorted(d for d, done in raw.items() if done)}
+    return {user: sorted(set(dates)) for user, dates in raw.items() if isinstance(dates, list)}
+
+
+def to_layout(data, layout):
+    if layout == "flat":
+        return {d: True for d in data.get(FLAT_USER, [])}
+    return data
+
+
+# --- индекс в памяти: INDEX=bitmap включает битовые карты вместо списков дней ---
+def new_index():
+    if os.environ.get("INDEX") == "bitmap":
+        from bitmap import BitmapIndex
+        return BitmapIndex()
+    return DateIndex()
+
+
+# --- общий интерфейс хранилища ---
+# user — строковый id пользователя (как ключи в data.json),
+# даты на входе и выходе — datetime.date, границы диапазонов включительно.
+class Storage:
+    def load_data(self):
+        raise NotImplementedError
+
+    def save_data(self, data):
+        raise NotImplementedError
+
+    def get_dates(self, user):
+        raise NotImplementedError
+
+    def record_today(self, user, day=None):
+        raise NotImplementedError
+
+    def count_range(self, user, start, end):
+        raise NotImplementedError
+
+    def reset(self, user):
+        raise NotImplementedError
+
+    def users(self):
+        return list(self.load_data())
+
+    def users_marked_on(self, day):
+        day_str = day.strftime(DATE_FORMAT)
+        return [user for user, dates in self.load_data().items() if day_str in dates]
+
+    # (user, [дни как date.toordinal()]) — для всех пользователей или только для users
+    def iter_marks(self, users=None):
+        data = self.load_data()
+        for user in (data if users is None else users):
+            yield user, sorted({parse_day(d).toordinal() for d in data.get(user, [])})
+
+    def count_total(self, user):
+        return len(self.get_dates(user))
+
+    def count_last_week(self, user, today=None):
+        today = today or datetime.now().date()
+        return self.count_range(user, today - timedelta(days=7), today)
+
+    # серии, последняя отметка и доля дней за 30/90 дней — см. rollups.Rollup.summary
+    def summary(self, user, today=None):
+        ordinals = [d.toordinal() for d in self.get_dates(user)]
+        return Rollup.build(ordinals).summary(today or datetime.now().date())
+
+    def close(self):
+        pass
+
+
+# --- откат изменений в памяти, если их пачка не записалась ---
+# undo — ("m", user, день) для отметки или ("r", user, дни до обнуления); откатываются
+# в обратном порядке. Изменения, поставленные в очередь позже, сохраняются: отметка
+# убирает только свой день, обнуление возвращает прежние дни к нынешним.
+# Вызывается под блокировкой хранилища.
+def rollback(index, rollups, undos):
+    for kind, user, value in reversed(undos):
+        if kind == "m":
+            index.load(user, [day for day in index.ordinals(user) if day != value])
+        else:
+            index.load(user, sorted(set(value) | set(index.ordinals(user))))
+        rollups.invalidate(user)
+
+
+# объём строк для метрик storage_io: байты текста и по 8 на число, без служебных данных SQLite
+def values_size(values):
+    return sum(len(v.encode("utf-8")) if isinstance(v, str) else 8 for v in values)
+
+
+# --- SQLite: одна строка на отметку, первичный ключ (user_id, day) служит индексом ---
+# История пользователя при первом обращении поднимается в DateIndex,
+# дальше подсчёты идут по памяти, а запись обновляет и базу, и индекс.
+# Отметки и обнуления сразу меняют индекс, а в базу уходят пачкой (GroupCommit):
+# одна транзакция с fsync на окно COMMIT_WINDOW, record_today и reset возвращаются,
+# когда их пачка закоммичена (AsyncStorage ждёт её, не занимая поток). Пока пачка в очереди, база отстаёт от индекса —
+# поэтому обнулённый пользователь остаётся в индексе с пустой историей.
+class SqliteStorage(Storage):
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.index = new_index()
+        self.rollups = RollupCache()
+        # timeout: в режиме WORKERS > 1 базу пишут несколько процессов
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # коммиты редкие и пачками — можно позволить fsync на каждый
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS marks ("
+            " user_id TEXT NOT NULL,"
+            " day INTEGER NOT NULL,"  # date.toordinal()
+            " PRIMARY KEY (user_id, day)"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+        self.commits = GroupCommit(self._write_batch, name="sqlite-commit")
+
+    # items — (sql, параметры, undo) в порядке поступления; транзакция откатывается целиком,
+    # и вместе с ней — изменения индекса от этой пачки
+    def _write_batch(self, items):
+        started = time.perf_counter()
+        try:
+            with self.lock, self.conn:
+                for sql, params, _ in items:
+                    self.conn.execute(sql, params)
+        except Exception:
+            with self.lock:
+                rollback(self.index, self.rollups, [undo for _, _, undo in items])
+            raise
+        if metrics.ENABLED:
+            metrics.storage_io("db_commit", started, sum(values_size(params) for _, params, _ in items))
+
+    def load_data(self):
+        self.commits.flush()
+        data = {}
+        started = time.perf_counter()
+        with self.lock:
+            rows = self.conn.execute("SELECT user_id, day FROM marks ORDER BY user_id, day").fetchall()
+        if metrics.ENABLED:
+            metrics.storage_io("db_read", started, sum(values_size(row) for row in rows))
+        for user, day in rows:
+            data.setdefault(user, []).append(datetime.fromordinal(day).strftime(DATE_FORMAT))
+        return data
+
+    def save_data(self, data):
+        self.commits.flush()
+        with self.lock, self.conn:
+            self.index = new_index()
+            self.rollups.clear()
+            self.conn.execute("DELETE FROM marks")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO marks (user_id, day) VALUES (?, ?)",
+                ((user, parse_day(d).toordinal()) for user, dates in data.items() for d in dates)
+            )
+
+    def users(self):
+        self.commits.flush()
+        with self.lock:
+            return [user for (user,) in self.conn.execute("SELECT DISTINCT user_id FROM marks")]
+
+    def users_marked_on(self, day):
+        self.commits.flush()
+        with self.lock:
+            rows = self.conn.execute("SELECT user_id FROM marks WHERE day = ?", (day.toordinal(),)).fetchall()
+        return [user for user, in rows]
+
+    # все пользователи читаются страницами по ITER_PAGE_USERS, блокировка — только на страницу
+    def iter_marks(self, users=None):
+        if users is None:
+            self.commits.flush()
+            last = None
+            while True:
+                started = time.perf_counter()
+                with self.lock:
+                    page = [user for (user,) in self.conn.execute(
+                        "SELECT DISTINCT user_id FROM marks WHERE ? IS NULL OR user_id > ? ORDER BY user_id LIMIT ?",
+                        (last, last, ITER_PAGE_USERS))]
+                    if not page:
+                        return
+                    rows = self.conn.execute(
+                        "SELECT user_id, day FROM marks WHERE user_id BETWEEN ? AND ? ORDER BY user_id, day",
+                        (page[0], page[-1])).fetchall()
+                if metrics.ENABLED:
+                    metrics.storage_io("db_read", started, sum(values_size(row) for row in rows))
+                for user, group in groupby(rows, key=lambda row: row[0]):
+                    yield user, [day for _, day in group]
+                last = page[-1]
+        for user in users:
+            with self.lock:
+                self._ensure_loaded(user)
+                ordinals = list(self.index.ordinals(user))
+            yield user, ordinals
+
+    # вызывается под self.lock
+    def _ensure_loaded(self, user):
+        if user not in self.index:
+            rows = self.conn.execute("SELECT day FROM marks WHERE user_id = ?", (user,)).fetchall()
+            self.index.load(user, (day for (day,) in rows))
+
+    def get_dates(self, user):
+        with self.lock:
+            self._ensure_loaded(user)
+            return self.index.dates(user)
+
+    # stage_* меняют индекс и ставят запись в очередь, возвращая её номер для commits
+    # (None — менять нечего); record_today и reset дожидаются пачки в потоке,
+    # AsyncStorage — в цикле событий
+    def stage_today(self, user, day=None):
+        day = day or datetime.now().date()
+        with self.lock:
+            self._ensure_loaded(user)
+            if self.index.has(user, day):
+                return None
+            self.index.add(user, day)
+            self.rollups.added(user, day.toordinal())
+            ordinal = day.toordinal()
+            return self.commits.stage(("INSERT OR IGNORE INTO marks (user_id, day) VALUES (?, ?)", (user, ordinal),
+                                       ("m", user, ordinal)))
+
+    def record_today(self, user, day=None):
+        seq = self.stage_today(user, day)
+        if seq is None:
+            return False
+        self.commits.wait(seq)
+        return True
+
+    def count_range(self, user, start, end):
+        with self.lock:
+            self._ensure_loaded(user)
+            return self.index.count(user, start, end)
+
+    def count_total(self, user):
+        with self.lock:
+            self._ensure_loaded(user)
+            return self.index.total(user)
+
+    # сводка обновляется в record_today, история поднимается только при промахе
+    def summary(self, user, today=None):
+        today = today or datetime.now().date()
+        with self.lock:
+            rollup = self.rollups.get(user, lambda: self._ordinals(user), today.toordinal())
+        return rollup.summary(today)
+
+    # вызывается под self.lock
+    def _ordinals(self, user):
+        self._ensure_loaded(user)
+        return self.index.ordinals(user)
+
+    def stage_reset(self, user):
+        with self.lock:
+            # прежние дни нужны для отката, если пачка не запишется
+            before = list(self._ordinals(user))
+            self.index.load(user, ())
+            self.rollups.invalidate(user)
+            return self.commits.stage(("DELETE FROM marks WHERE user_id = ?", (user,), ("r", user, before)))
+
+    def reset(self, user):
+        self.commits.wait(self.stage_reset(user))
+
+    # rows — (user, date.toordinal()); возвращает, сколько строк добавлено
+    def insert_marks(self, rows):
+        self.commits.flush()
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO marks (user_id, day) VALUES (?, ?)", rows)
+            # закэшированные истории этих пользователей устарели
+            for user in {user for user, _ in rows}:
+                self.index.remove_user(user)
+                self.rollups.invalidate(user)
+            return self.conn.total_changes - before
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self):
+        self.commits.close()
+        self.conn.close()
+
+
+# --- разовая миграция data.json -> SQLite ---
+def migrate_from_json(storage, json_path=DATA_FILE):
+    if storage.get_meta("migrated_from") or not os.path.exists(json_path):
+        return 0
+    # файл читается потоково, без json.load целиком (datafile.py)
+    from datafile import import_json
+    try:
+        count = import_json(storage, json_path)
+    except ValueError as e:
+        # перенесённое до ошибки остаётся, повтор при следующем запуске ничего не задвоит
+        print(f"⚠ Не удалось дочитать {json_path}: {e}")
+        return 0
+    storage.set_meta("migrated_from", os.path.abspath(json_path))
+    return count
+
+
+# --- выбор хранилища через переменную окружения, как TOKEN ---
+# layout задаёт формат снимка data.json для файлового хранилища
+# STORAGE=mmap — data.json с индексом смещений (mmapstore.py) для быстрого холодного старта;
+# плоский формат — одна история на всех, ему индекс не нужен, он открывается как json
+def open_storage(layout="users"):
+    kind = os.environ.get("STORAGE", "sqlite")
+    if kind == "mmap" and layout == "users":
+        from mmapstore import MmapStorage
+        return MmapStorage(os.environ.get("DATA_FILE", DATA_FILE))
+    if kind in ("json", "mmap"):
+        from eventlog import EventLogStorage
+        return EventLogStorage(os.environ.get("DATA_FILE", DATA_FILE), layout=layout)
+    if kind == "sqlite":
+        storage = SqliteStorage(os.environ.get("DB_FILE", DB_FILE))
+        migrated = migrate_from_json(storage, os.environ.get("DATA_FILE", DATA_FILE))
+        if migrated:
+            print(f"Перенесено отметок из data.json: {migrated}")
+        return storage
+    raise ValueError(f"Неизвестное хранилище STORAGE={kind!r}")
+
+
+# --- обёртка для хэндлеров: все вызовы уходят в поток, не блокируя event loop ---
+# Отметка и обнуление в потоке только ставятся в очередь (stage_*), а своей пачки ждут
+# в цикле событий через commits.durable: поток пула не простаивает до коммита,
+# и размер пачки не упирается в число потоков.
+class AsyncStorage:
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def record_today(self, user, day=None):
+        started = time.perf_counter()
+        try:
+            seq = await asyncio.to_thread(self.storage.stage_today, user, day)
+            if seq is None:
+                return False
+            await self.storage.commits.durable(seq)
+            return True
+        finally:
+            if metrics.ENABLED:
+                metrics.STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, "record_today")
+
+    async def reset(self, user):
+        started = time.perf_counter()
+        try:
+            seq = await asyncio.to_thread(self.storage.stage_reset, user)
+            if seq is not None:
+                await self.storage.commits.durable(seq)
+        finally:
+            if metrics.ENABLED:
+                metrics.STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, "reset")
+
+    def __getattr__(self, name):
+        func = getattr(self.storage, name)
+        if metrics.ENABLED:
+            return self._timed(name, func)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return call
+
+    @staticmethod
+    def _timed(name, func):
+        async def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await asyncio.to_thread(func, *args, **kwargs)
+            finally:
+                metrics.STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, name)
+        return call
+
+
+# --- post_shutdown для Application: дописать журнал и закрыть файлы ---
+async def close_storage(app):
+    await app.bot_data["storage"].close()
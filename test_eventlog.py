@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+import eventlog
+from eventlog import EventLogStorage
+from mmapstore import MmapStorage
+
+DAY = date(2024, 1, 2)
+
+
+# --- журнал после падения и после ошибки записи: подтверждённое не теряется ---
+# «Падение» — открыть хранилище заново, не закрывая старое (без компактизации при close).
+class TornLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "data.json")
+        self.opened = []
+
+    def tearDown(self):
+        for storage in self.opened:
+            storage.commits.close()
+            storage.closing.set()
+        shutil.rmtree(self.dir)
+
+    def open(self, cls):
+        storage = cls(self.path, commit_window=0)
+        self.opened.append(storage)
+        return storage
+
+    def test_torn_tail_is_cut_on_recovery(self):
+        for cls in (EventLogStorage, MmapStorage):
+            with self.subTest(cls.__name__):
+                with open(self.path + ".log", "w", encoding="utf-8") as f:
+                    f.write('["m", "1", "2024-01-01"]\n["m","1","2024-01-')
+                storage = self.open(cls)
+                self.assertTrue(storage.record_today("2", DAY))
+                storage = self.open(cls)
+                self.assertEqual(storage.get_dates("2"), [DAY])
+                self.assertEqual(storage.get_dates("1"), [date(2024, 1, 1)])
+                os.remove(self.path + ".log")
+
+    def test_failed_batch_is_cut(self):
+        for cls in (EventLogStorage, MmapStorage):
+            with self.subTest(cls.__name__):
+                storage = self.open(cls)
+                self.assertTrue(storage.record_today("1", DAY))
+
+                def half_then_fail(fd, data):
+                    os.write(fd, data[:len(data) // 2])
+                    raise OSError("disk full")
+                with mock.patch.object(eventlog, "write_all", half_then_fail):
+                    with self.assertRaises(OSError):
+                        storage.record_today("2", DAY)
+                self.assertTrue(storage.record_today("3", DAY))
+
+                storage = self.open(cls)
+                self.assertEqual(storage.get_dates("1"), [DAY])
+                self.assertEqual(storage.get_dates("3"), [DAY])
+                os.remove(self.path + ".log")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+import eventlog
+from eventlog import EventLogStorage
+from mmapstore import MmapStorage
+from storage import SqliteStorage
+
+DAY = date(2024, 1, 2)
+
+
+# соединение, у которого падает любая запись: транзакция пачки откатывается
+class FailingConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self.conn.__exit__(*exc)
+
+
+# --- пачка не записалась: изменения в памяти откатываются, повтор проходит ---
+class RollbackTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open(self, kind):
+        if kind == "sqlite":
+            return SqliteStorage(os.path.join(self.dir, "data.db"))
+        cls = EventLogStorage if kind == "json" else MmapStorage
+        return cls(os.path.join(self.dir, "data.json"), commit_window=0)
+
+    def failing(self, storage):
+        if isinstance(storage, SqliteStorage):
+            return mock.patch.object(storage, "conn", FailingConnection(storage.conn))
+        return mock.patch.object(eventlog, "write_all", mock.Mock(side_effect=OSError("disk full")))
+
+    def test_failed_mark_and_reset(self):
+        for kind in ("sqlite", "json", "mmap"):
+            with self.subTest(kind):
+                storage = self.open(kind)
+                with self.failing(storage), self.assertRaises(Exception):
+                    storage.record_today("1", DAY)
+                self.assertEqual(storage.count_total("1"), 0)
+                self.assertEqual(storage.summary("1", DAY)["total"], 0)
+                self.assertTrue(storage.record_today("1", DAY))
+
+                with self.failing(storage), self.assertRaises(Exception):
+                    storage.reset("1")
+                self.assertEqual(storage.get_dates("1"), [DAY])
+                storage.close()
+
+                storage = self.open(kind)
+                self.assertEqual(storage.get_dates("1"), [DAY])
+                storage.close()
+                for name in os.listdir(self.dir):
+                    os.remove(os.path.join(self.dir, name))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+import os
+import json
+import asyncio
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: один процесс, блокировка файла не нужна
+    fcntl = None
+
+from groupcommit import GroupCommit
+
+# --- настройки пользователей ---
+# user_settings.jsonl: по строке на изменение, {"chat_id": ..., "hour": ..., "minute": ..., "tz": ...};
+# для каждого chat_id действует последняя строка. Файл читается потоково.
+# Строки только дописываются, поэтому после SETTINGS_COMPACT_LINES дописанных строк и при
+# закрытии файл переписывается заново — по строке на chat_id (временный файл + os.replace).
+USER_SETTINGS_FILE = "user_settings.jsonl"
+SETTINGS_COMPACT_LINES = int(os.environ.get("SETTINGS_COMPACT_LINES", "10000"))
+DEFAULT_TZ = os.environ.get("BOT_TZ", "UTC")
+
+
+# contains — разбирать только строки с этой подстрокой
+def iter_user_settings(path=USER_SETTINGS_FILE, contains=None):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if contains is not None and contains not in line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield record.pop("chat_id"), record
+
+
+def load_user_settings(chat_id, defaults, path=USER_SETTINGS_FILE):
+    settings = dict(defaults)
+    # строки без этого числа не разбираются: поиск одного пользователя в разы быстрее полного чтения
+    for other_id, record in iter_user_settings(path, str(chat_id)):
+        if other_id == chat_id:
+            settings.update(record)
+    return settings
+
+
+def settings_line(chat_id, settings):
+    return json.dumps({"chat_id": chat_id, **settings}, ensure_ascii=False) + "\n"
+
+
+# --- кэш настроек в памяти ---
+# Файл читается один раз (load) или, до полной загрузки, по пользователю при первом
+# обращении — в потоке, чтобы проход по файлу не держал цикл событий; запоминается и то,
+# что пользователя в файле нет. Дальше get() отвечает из памяти. update() сразу меняет память и сообщает
+# подписчикам, чьи настройки изменились, — перепланировать нужно только его; строка
+# в файл уходит пачкой со всеми изменениями за окно (GroupCommit, один fsync),
+# и update() возвращается, когда пачка на диске.
+class UserSettingsStore:
+    def __init__(self, defaults, path=USER_SETTINGS_FILE):
+        self.defaults = dict(defaults)
+        self.path = path
+        self.records = {}  # chat_id -> сохранённые значения поверх defaults
+        self.missing = set()  # chat_id, которых нет в файле, — пока он не загружен целиком
+        self.loaded = False
+        self.listeners = []
+        self.appended = 0  # строк дописано с последнего сжатия
+        self.commits = GroupCommit(self._write_lines, name="settings-commit")
+
+    # В режиме WORKERS > 1 файл общий, а в памяти у воркера только свои пользователи,
+    # поэтому сжатие переписывает файл по нему самому, а не по records. Дописывание
+    # и сжатие идут под блокировкой файла .lock, чтобы строка другого воркера не ушла
+    # в старый файл, пока пишется новый.
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # пачка уходит одним os.write в O_APPEND: в общем файле её строки не перемешаются
+    # со строками других воркеров; недописанная пачка обрезается, чтобы не склеиться со следующей
+    def _write_lines(self, lines):
+        data = "".join(lines).encode("utf-8")
+        with self._file_lock():
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                try:
+                    if os.write(fd, data) != len(data):
+                        raise OSError(f"{self.path}: записана не вся пачка")
+                    os.fsync(fd)
+                except OSError:
+                    try:
+                        os.ftruncate(fd, size)
+                    except OSError as e:
+                        print(f"⚠ Не удалось обрезать {self.path} после ошибки записи: {e}")
+                    raise
+            finally:
+                os.close(fd)
+        self.appended += len(lines)
+        if self.appended >= SETTINGS_COMPACT_LINES:
+            try:
+                self.compact()
+            except OSError as e:
+                print(f"⚠ Не удалось сжать {self.path}: {e}")
+
+    def compact(self):
+        with self._file_lock():
+            if not os.path.exists(self.path):
+                return
+            latest, lines = {}, 0
+            for chat_id, record in iter_user_settings(self.path):
+                latest.setdefault(chat_id, {}).update(record)
+                lines += 1
+            if lines > len(latest):
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(settings_line(chat_id, record) for chat_id, record in latest.items())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+        self.appended = 0
+
+    # accept(chat_id) — оставить в памяти только своих пользователей (шард)
+    def load(self, accept=None):
+        return self.merge(self.read(accept))
+
+    # только чтение файла, состояние не меняется — можно вызывать из потока
+    def read(self, accept=None):
+        records = {}
+        for chat_id, record in iter_user_settings(self.path):
+            if accept is None or accept(chat_id):
+                records.setdefault(chat_id, {}).update(record)
+        return records
+
+    # изменённые через update(), пока файл читался, новее прочитанного и остаются
+    def merge(self, records):
+        for chat_id, record in records.items():
+            self.records.setdefault(chat_id, record)
+        self.loaded = True
+        self.missing.clear()
+        return self
+
+    def __contains__(self, chat_id):
+        return chat_id in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def items(self):
+        for chat_id, record in self.records.items():
+            yield chat_id, {**self.defaults, **record}
+
+    async def get(self, chat_id):
+        if chat_id not in self.records and not self.loaded and chat_id not in self.missing:
+            record = await asyncio.to_thread(load_user_settings, chat_id, {}, self.path)
+            # пока читали, могли прийти update() или merge() — их значения новее
+            if chat_id not in self.records and not self.loaded:
+                if record:
+                    self.records[chat_id] = record
+                else:
+                    self.missing.add(chat_id)
+        return {**self.defaults, **self.records.get(chat_id, {})}
+
+    def subscribe(self, callback):
+        # callback(chat_id, settings) после каждого update
+        self.listeners.append(callback)
+
+    async def update(self, chat_id, **changes):
+        settings = {**await self.get(chat_id), **changes}
+        seq = self.commits.stage(settings_line(chat_id, settings))
+        self.records[chat_id] = settings
+        for callback in self.listeners:
+            callback(chat_id, settings)
+        await self.commits.durable(seq)
+        return settings
+
+    def close(self):
+        self.commits.close()
+        try:
+            self.compact()
+        except OSError as e:
+            print(f"⚠ Не удалось сжать {self.path}: {e}")
@@ -0,0 +1,133 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+
+# --- приём обновлений: long polling или вебхук на aiohttp ---
+# MODE=webhook включает вебхук, иначе работает app.run_polling(), как раньше.
+# WEBHOOK_URL — публичный адрес (https://example.com), путь берётся из WEBHOOK_PATH,
+# WEBHOOK_SECRET сверяется с заголовком X-Telegram-Bot-Api-Secret-Token; без него вебхук
+# не запускается — иначе любой, кто узнал адрес, может прислать поддельные обновления.
+# Если обновлений в очереди и в обработке больше WEBHOOK_MAX_QUEUE, отвечаем 503 и Telegram повторит доставку позже.
+# aiohttp импортируется только в режиме вебхука: при long polling он не нужен и замедляет старт.
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+SECRET_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-")
+
+
+# --- адрес Bot API ---
+# TELEGRAM_API_URL — свой сервер Bot API или локальная заглушка (fake_api.py для bench_load.py)
+def api_urls():
+    url = os.environ.get("TELEGRAM_API_URL", "").rstrip("/")
+    if not url:
+        return {}
+    return {"base_url": url + "/bot", "base_file_url": url + "/file/bot"}
+
+
+def app_builder(token):
+    builder = ApplicationBuilder().token(token)
+    urls = api_urls()
+    if urls:
+        builder = builder.base_url(urls["base_url"]).base_file_url(urls["base_file_url"])
+    return builder
+
+
+def run(app):
+    if os.environ.get("MODE", "polling") == "webhook":
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
+
+
+# секрет — 1-256 символов A-Z, a-z, 0-9, _ и -, как требует setWebhook
+def webhook_secret():
+    secret = os.environ.get("WEBHOOK_SECRET", "")
+    if not secret:
+        raise ValueError("Для MODE=webhook нужен WEBHOOK_SECRET")
+    if len(secret) > 256 or not set(secret) <= SECRET_CHARS:
+        raise ValueError("WEBHOOK_SECRET: до 256 символов A-Z, a-z, 0-9, _ и -")
+    return secret
+
+
+def make_web_app(app, path, secret, max_queue):
+    from aiohttp import web
+    from admission import backlog  # admission -> sharding -> webhook: импорт здесь, а не в начале модуля
+
+    async def receive_update(request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=403)
+        if backlog(app) >= max_queue:
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        try:
+            update = Update.de_json(await request.json(), app.bot)
+        except (json.JSONDecodeError, TypeError, KeyError, AttributeError):
+            return web.Response(status=400)
+        await app.update_queue.put(update)
+        return web.Response()
+
+    async def health(request):
+        return web.Response(text="ok")
+
+    web_app = web.Application()
+    web_app.router.add_post(path, receive_update)
+    web_app.router.add_get("/healthz", health)
+    return web_app
+
+
+async def run_webhook(app):
+    url = os.environ["WEBHOOK_URL"].rstrip("/")
+    path = os.environ.get("WEBHOOK_PATH", "/telegram")
+    secret = webhook_secret()
+    max_queue = int(os.environ.get("WEBHOOK_MAX_QUEUE", "1000"))
+    host = os.environ.get("LISTEN", "0.0.0.0")
+    port = int(os.environ.get("PORT", "8080"))
+
+    async def serve():
+        await app.bot.set_webhook(url + path, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+        print(f"Вебхук слушает {host}:{port}{path}")
+        await serve_http(make_web_app(app, path, secret, max_queue), host, port, wait_for_signal())
+
+    await run_app(app, serve)
+
+
+def wait_for_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop.wait()
+
+
+# сервер работает, пока не завершится until; потом перестаёт принимать запросы и дожидается текущих
+async def serve_http(web_app, host, port, until):
+    from aiohttp import web
+
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        await until
+    finally:
+        await runner.cleanup()
+
+
+# --- жизненный цикл Application без run_polling: serve() кладёт обновления в app.update_queue ---
+# post_init/post_shutdown вызывает только run_polling, здесь — вручную.
+# app.stop() дорабатывает всё, что уже лежит в очереди.
+async def run_app(app, serve):
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        await serve()
+    finally:
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)